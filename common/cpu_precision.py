@@ -0,0 +1,124 @@
+import argparse
+import csv
+import os
+
+import torch
+from ultralytics import YOLO
+
+PRECISION_MODES = ['fp32', 'bf16', 'int8']
+
+
+def _to_float32(out):
+    if isinstance(out, torch.Tensor):
+        return out.float() if out.is_floating_point() else out
+    if isinstance(out, (list, tuple)):
+        return type(out)(_to_float32(o) for o in out)
+    if isinstance(out, dict):
+        return {k: _to_float32(v) for k, v in out.items()}
+    return out
+
+
+def enable_bf16(model: YOLO) -> YOLO:
+    """
+    Runs the network forward under CPU bfloat16 autocast. Only the forward is affected: its outputs are cast
+    back to float32, so NMS, plotting and the CAM code downstream keep working on fp32 tensors.
+    Pays off on CPUs with native bf16 support (AVX512-BF16 / AMX), elsewhere it can be slower than fp32.
+    """
+    net = model.model
+    forward = net.forward
+
+    def bf16_forward(*args, **kwargs):
+        with torch.autocast('cpu', dtype=torch.bfloat16):
+            out = forward(*args, **kwargs)
+        return _to_float32(out)
+
+    net.forward = bf16_forward
+    return model
+
+
+def int8_export_dir(model_path: str) -> str:
+    """Directory ultralytics writes the INT8 OpenVINO export of a checkpoint to."""
+    return os.path.splitext(model_path)[0] + '_int8_openvino_model'
+
+
+def load_cpu_precision_model(model_path: str, mode: str = 'fp32', data: str = None, imgsz: int = 640) -> YOLO:
+    """
+    Loads a detector for CPU inference in one of PRECISION_MODES.
+    'int8' uses ultralytics' OpenVINO INT8 export (post-training quantization calibrated on `data`, a dataset yaml).
+    The export is cached next to the checkpoint, later runs load it without `data`.
+    An 'int8' model has no PyTorch modules, so it cannot be used for CAM hooks. It needs the openvino extra (openvino, nncf).
+    """
+    if mode not in PRECISION_MODES:
+        raise ValueError(f"Unknown precision '{mode}', expected one of {PRECISION_MODES}")
+    if mode == 'int8':
+        export_dir = int8_export_dir(model_path)
+        if not os.path.isdir(export_dir):
+            if data is None:
+                raise ValueError(f"No INT8 export at {export_dir}: pass a dataset yaml to calibrate the quantization")
+            print(f"Exporting {model_path} to INT8 OpenVINO (calibrating on {data})...")
+            YOLO(model_path).export(format='openvino', int8=True, data=data, imgsz=imgsz)
+        return YOLO(export_dir, task='detect')
+    model = YOLO(model_path)
+    return enable_bf16(model) if mode == 'bf16' else model
+
+
+def evaluate(model: YOLO, data: str, split: str = 'test', imgsz: int = 640, batch: int = 1) -> dict:
+    """mAP50, mAP50-95 and the per-image CPU times of ultralytics' validator."""
+    res = model.val(data=data, split=split, imgsz=imgsz, batch=batch, device='cpu', plots=False, verbose=False)
+    return {'map50': float(res.box.map50), 'map50_95': float(res.box.map),
+            'inference_ms': float(res.speed['inference']),
+            'total_ms': float(res.speed['preprocess'] + res.speed['inference'] + res.speed['postprocess'])}
+
+
+def compare_precisions(model_path: str, data: str, modes=('bf16', 'int8'), split: str = 'test', imgsz: int = 640, batch: int = 1) -> list:
+    """
+    Runs the split through the fp32 model and every reduced-precision mode.
+    Returns one row per mode with the mAP deltas against fp32 and the inference speedup.
+    """
+    reference = evaluate(load_cpu_precision_model(model_path, 'fp32'), data, split, imgsz, batch)
+    rows = [dict(reference, model=model_path, precision='fp32', map50_delta=0.0, map50_95_delta=0.0, speedup=1.0)]
+    for mode in modes:
+        try:
+            result = evaluate(load_cpu_precision_model(model_path, mode, data, imgsz), data, split, imgsz, batch)
+        except Exception as e:
+            print(f"Error evaluating {model_path} in {mode}: {e}. Skipping this mode.")
+            continue
+        rows.append(dict(result, model=model_path, precision=mode,
+                         map50_delta=result['map50'] - reference['map50'],
+                         map50_95_delta=result['map50_95'] - reference['map50_95'],
+                         speedup=reference['inference_ms'] / max(result['inference_ms'], 1e-9)))
+    return rows
+
+
+def print_comparison(rows: list):
+    print("\n--- CPU Precision Comparison ---")
+    for row in rows:
+        print(f"{os.path.basename(row['model'])} | {row['precision']:5s} | mAP50 {row['map50']:.4f} ({row['map50_delta']:+.4f}) | "
+              f"mAP50-95 {row['map50_95']:.4f} ({row['map50_95_delta']:+.4f}) | "
+              f"inference {row['inference_ms']:.1f} ms/img ({row['speedup']:.2f}x)")
+
+
+COMPARISON_FIELDNAMES = ['model', 'precision', 'map50', 'map50_95', 'map50_delta', 'map50_95_delta', 'inference_ms', 'total_ms', 'speedup']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare fp32 CPU inference with bf16 / INT8 on a dataset split (mAP delta and speedup).")
+    parser.add_argument('--models', nargs='+', required=True, help="Checkpoints to compare.")
+    parser.add_argument('--data', required=True, help="Dataset yaml, e.g. ready_dataset/data.yaml (also used for INT8 calibration).")
+    parser.add_argument('--split', default='test', help="Split to evaluate.")
+    parser.add_argument('--modes', nargs='+', choices=PRECISION_MODES[1:], default=PRECISION_MODES[1:],
+                        help="Reduced precisions to compare against fp32. int8 needs the openvino extra (uv sync --extra openvino).")
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--batch', type=int, default=1, help="Validation batch size (1 measures per-image latency).")
+    parser.add_argument('--out', default='precision_comparison.csv', help="Output CSV.")
+    args = parser.parse_args()
+
+    all_rows = []
+    for model_path in args.models:
+        all_rows += compare_precisions(model_path, args.data, args.modes, args.split, args.imgsz, args.batch)
+    print_comparison(all_rows)
+    with open(args.out, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COMPARISON_FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(all_rows)
+    print(f"\nSaved comparison to {args.out}")
@@ -0,0 +1,286 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Upper bounds in seconds, from a fast resize up to a full model load
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_OUT_ENV = 'METRICS_OUT'
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('registry', 'name', 'labels', 'start')
+
+    def __init__(self, registry, name: str, labels: tuple):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe_labels(f"{self.name}_seconds", time.perf_counter() - self.start, self.labels)
+        return False
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense, plus min and max."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def to_dict(self) -> dict:
+        cumulative, total = [], 0
+        for c in self.counts:
+            total += c
+            cumulative.append(total)
+        return {'count': self.count, 'sum': self.sum, 'min': self.min if self.count else None,
+                'max': self.max if self.count else None,
+                'buckets': {str(b): c for b, c in zip(self.buckets, cumulative)}}
+
+
+class Registry:
+    """
+    Counters, gauges and histograms keyed by (name, labels).
+    While disabled every call returns after one attribute check and nothing is recorded.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.start_time = time.time()
+        self.snapshot = False
+        self.exporter = None
+
+    def configure(self, path: str = None, job: str = None, snapshot: bool = False):
+        """
+        Enables recording when a path is given (or set in $METRICS_OUT) and exports to it at exit.
+        '*.prom' files are written in the Prometheus text format (overwritten on every export),
+        anything else as JSON lines (one line per series, appended on every export,
+        or overwritten with the latest snapshot if `snapshot` is set).
+        """
+        path = path or os.environ.get(METRICS_OUT_ENV)
+        if not path:
+            return
+        self.path = path
+        self.snapshot = snapshot
+        self.job = job or os.path.splitext(os.path.basename(sys.argv[0]))[0]
+        if not self.enabled:
+            self.enabled = True
+            atexit.register(self.export)
+
+    def export_every(self, interval: float):
+        """Exports every `interval` seconds from a daemon thread, for processes that never reach exit; started once."""
+        if not self.enabled or self.exporter is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.export()
+
+        self.exporter = threading.Thread(target=loop, name='metrics-exporter', daemon=True)
+        self.exporter.start()
+
+    def reset(self):
+        """Drops every recorded series, e.g. the parent's copy in a forked pool worker."""
+        with self.lock:
+            self.counters, self.gauges, self.histograms = {}, {}, {}
+        self.start_time = time.time()
+
+    def timer(self, name: str, **labels):
+        """Context manager recording the duration of its block into the `<name>_seconds` histogram."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, tuple(sorted(labels.items())))
+
+    def count(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        self.observe_labels(name, value, tuple(sorted(labels.items())))
+
+    def observe_labels(self, name: str, value: float, labels: tuple):
+        key = (name, labels)
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(value)
+
+    def record_memory(self):
+        """Sets the peak and current RSS gauges of this process."""
+        if not self.enabled or resource is None:
+            return
+        self.gauge('process_peak_rss_bytes', peak_rss_bytes())
+        try:
+            with open('/proc/self/statm') as f:
+                self.gauge('process_rss_bytes', int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE'))
+        except (OSError, ValueError, IndexError):
+            pass
+
+    def _series(self) -> list:
+        # Sorted by name, the Prometheus format wants all series of a metric in one group
+        by_name = lambda item: item[0][0]
+        with self.lock:
+            return ([('counter', name, dict(labels), value) for (name, labels), value in sorted(self.counters.items(), key=by_name)] +
+                    [('gauge', name, dict(labels), value) for (name, labels), value in sorted(self.gauges.items(), key=by_name)] +
+                    [('histogram', name, dict(labels), hist.to_dict())
+                     for (name, labels), hist in sorted(self.histograms.items(), key=by_name)])
+
+    def export(self, path: str = None):
+        if not self.enabled:
+            return
+        self.record_memory()
+        self.gauge('process_uptime_seconds', time.time() - self.start_time)
+        path = path or self.path
+        if path.endswith('.prom'):
+            self._export_prometheus(path)
+        else:
+            self._export_jsonl(path)
+
+    def _export_jsonl(self, path: str):
+        now = time.time()
+        lines = [json.dumps({'time': now, 'job': self.job, 'pid': os.getpid(), 'type': kind, 'name': name,
+                             'labels': labels, 'value': value})
+                 for kind, name, labels, value in self._series()]
+        if self.snapshot:
+            self._write_atomic(path, lines)
+            return
+        # One write per export in append mode, so lines of concurrent processes do not interleave
+        with open(path, 'a') as f:
+            f.write(''.join(line + '\n' for line in lines))
+
+    @staticmethod
+    def _write_atomic(path: str, lines: list):
+        # Readers (or a textfile collector) never see half a file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+
+    def _export_prometheus(self, path: str):
+        def fmt_labels(labels: dict, extra: dict = None) -> str:
+            labels = dict({'job': self.job}, **labels, **(extra or {}))
+            return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+        lines, typed = [], set()
+        for kind, name, labels, value in self._series():
+            if name not in typed:
+                lines.append(f"# TYPE {name} {kind}")
+                typed.add(name)
+            if kind != 'histogram':
+                lines.append(f"{name}{fmt_labels(labels)} {value}")
+                continue
+            for bound, cumulative in value['buckets'].items():
+                lines.append(f"{name}_bucket{fmt_labels(labels, {'le': bound})} {cumulative}")
+            lines.append(f"{name}_bucket{fmt_labels(labels, {'le': '+Inf'})} {value['count']}")
+            lines.append(f"{name}_sum{fmt_labels(labels)} {value['sum']}")
+            lines.append(f"{name}_count{fmt_labels(labels)} {value['count']}")
+        self._write_atomic(path, lines)
+
+
+_registry = Registry()
+
+configure = _registry.configure
+timer = _registry.timer
+count = _registry.count
+gauge = _registry.gauge
+observe = _registry.observe
+export = _registry.export
+export_every = _registry.export_every
+reset = _registry.reset
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process, None where the resource module is missing (Windows)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def compare_to_baseline(checks: list, tolerance: float, name_width: int = 16, unit: str = '') -> list:
+    """
+    Prints the relative change of every (name, current, baseline, higher_is_better) check, a missing baseline
+    value is shown as such. Returns the names that got worse by more than `tolerance` (0.1 = 10%).
+    """
+    regressions = []
+    print("\n--- Comparison to baseline ---")
+    for name, current, base, higher_is_better in checks:
+        if not base:
+            print(f"  {name:{name_width}s} {current:10.2f}{unit} (no baseline)")
+            continue
+        change = (current - base) / base
+        worse = -change if higher_is_better else change
+        flag = ''
+        if worse > tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif worse < -tolerance:
+            flag = '  improved'
+        print(f"  {name:{name_width}s} {base:10.2f} -> {current:10.2f}{unit} ({change * 100:+6.1f}%){flag}")
+    return regressions
+
+
+def is_enabled() -> bool:
+    return _registry.enabled
+
+
+def worker_path(path: str) -> str:
+    """Per-process file name for pool workers: JSON lines can share one file, Prometheus files cannot."""
+    if path and path.endswith('.prom'):
+        return f"{path[:-len('.prom')]}.{os.getpid()}.prom"
+    return path
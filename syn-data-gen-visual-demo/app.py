@@ -2,54 +2,234 @@
 import streamlit as st
 import os
 import glob
-from ultralytics import YOLO
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict, defaultdict
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import torch
 from PIL import Image
 from io import BytesIO
+from ultralytics.engine.results import Results
+import instrumentation
+import warmup
+from cpu_precision import PRECISION_MODES
+from inference_client import InferenceClient
+from thumbnails import THUMBNAIL_DIR, list_image_files, thumbnail_path
+from video_stream import VideoPipeline
 
 # --- App Configuration ---
 st.set_page_config(layout="wide", page_title="YOLO Object Detection App")
+# Off unless $METRICS_OUT is set; the registry lives in the module, so it accumulates across reruns.
+# Streamlit never exits the script, so a background thread overwrites one snapshot file periodically
+instrumentation.configure(job="syn-data-gen-visual-demo", snapshot=True)
+instrumentation.export_every(int(os.environ.get("METRICS_INTERVAL", "30")))
+
+# Predictions are computed once at this confidence and filtered by the slider afterwards
+CONF_FLOOR = 0.001
+PREDICTION_CACHE_MB = int(os.environ.get("PREDICTION_CACHE_MB", "64"))
+# Models run side by side in the comparison; each worker gets an equal share of the cores for torch
+COMPARE_WORKERS = int(os.environ.get("COMPARE_WORKERS", "0"))  # 0: one worker per model
+# Default URL of inference_server.py; when set, the app sends images there instead of loading the models
+INFERENCE_URL = os.environ.get("INFERENCE_URL", "")
+# Images are downscaled once so their long side is at most the model's input size; the letterbox would
+# shrink them to this anyway, so predictions match and nothing per interaction depends on the original resolution
+INFERENCE_SIZE = int(os.environ.get("INFERENCE_SIZE", "640"))
+THUMBNAILS_PER_PAGE = int(os.environ.get("THUMBNAILS_PER_PAGE", "24"))
 
 # --- Helper Functions ---
 
 
-@st.cache_data
-def load_image(image_path):
-    """Loads an image from a file path."""
-    try:
-        return Image.open(image_path)
-    except Exception as e:
-        st.error(f"Error loading image '{image_path}': {e}")
-        return None
+def downscale(image):
+    """
+    RGB image with its long side at most INFERENCE_SIZE and the original size.
+    JPEGs are decoded directly at a reduced scale (draft), so a 4000 px upload is never fully decoded.
+    """
+    original_size = image.size
+    image.draft("RGB", (INFERENCE_SIZE, INFERENCE_SIZE))
+    image = image.convert("RGB")
+    image.thumbnail((INFERENCE_SIZE, INFERENCE_SIZE), Image.BILINEAR)
+    return image, original_size
+
+
+@st.cache_resource(max_entries=64)
+def load_image(image_path, mtime_ns):
+    """
+    Loads and downscales an image from a file path (mtime_ns is only part of the cache key).
+    Raises on a read error, so a failure is not cached and the next rerun tries again.
+    """
+    with instrumentation.timer('disk_io', op='image_load'):
+        return downscale(Image.open(image_path))
+
+
+@st.cache_resource(max_entries=16)
+def decode_upload(digest, _data):
+    """Decodes and downscales an upload once per content hash (Streamlit does not hash the _data argument)."""
+    with instrumentation.timer('preprocess', op='upload_decode'):
+        return downscale(Image.open(BytesIO(_data)))
+
+
+@st.cache_resource(max_entries=16)
+def encode_image(image_key, _image):
+    """PNG of the downscaled image, sent to the inference server so its boxes are in the rendered image's coordinates."""
+    buffer = BytesIO()
+    _image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class ModelRegistry:
+    """
+    Loads and warms models on a thread pool, one future per (model path, precision).
+    Created once per server, it starts loading every model in fp32 right away, so the models are ready
+    (or on their way) before the first comparison. Models the startup warmup (serve.py) covers are taken from it.
+    The comparison inferences run on a second pool of `workers` threads, so a slow load never holds up a model
+    that is ready: torch releases the GIL in its kernels, so the models run concurrently.
+    torch's intra-op thread count is process-wide; it is set once to cores / workers, so that many models
+    running side by side do not oversubscribe the CPU.
+    A model instance is shared by every session, but an ultralytics predictor is not thread-safe:
+    calls to predict hold the model's predict_lock, so one model only runs one inference at a time.
+    """
+
+    def __init__(self, model_paths, workers, preload=True):
+        self.workers = max(1, workers)
+        self.torch_threads = max(1, (os.cpu_count() or 1) // self.workers)
+        torch.set_num_threads(self.torch_threads)
+        self.loader = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="model-load")
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="model")
+        self.futures = {}
+        self.predict_locks = defaultdict(threading.Lock)
+        self.lock = threading.Lock()
+        for model_path in model_paths if preload else ():
+            self.get(model_path, "fp32")
+
+    def get(self, model_path, precision):
+        """Future of the warmed model; raises the load error on result()."""
+        with self.lock:
+            key = (model_path, precision)
+            if key not in self.futures:
+                self.futures[key] = (warmup.pending_model(model_path, precision)
+                                     or self.loader.submit(warmup.load_and_warm_model, model_path, precision))
+            return self.futures[key]
+
+    def predict_lock(self, model_path, precision):
+        with self.lock:
+            return self.predict_locks[(model_path, precision)]
+
+    def submit(self, fn, *args):
+        return self.executor.submit(fn, *args)
 
 
 @st.cache_resource
-def load_model(model_path):
-    """Loads a YOLO model from a file path."""
+def get_model_registry(model_paths, workers, preload=True):
+    return ModelRegistry(model_paths, workers, preload)
+
+
+def load_model(model_path, precision="fp32"):
+    """Returns the warmed model for model_path, waiting for its background load if needed."""
     try:
-        model = YOLO(model_path)
-        return model
+        return model_registry.get(model_path, precision).result()
     except Exception as e:
         st.error(f"Error loading model: {e}")
         return None
 
 
-def detect_objects(model, image, conf_threshold):
-    """Performs object detection on the image."""
-    results = model.predict(image, conf=conf_threshold)
-    return results[0]
+class PredictionCache:
+    """
+    LRU of raw detections per (image content hash, model, precision), bounded by bytes.
+    Entries are the (N, 6) xyxy/conf/class array at CONF_FLOOR and the class names.
+    Shared by all sessions, so it is guarded by a lock.
+    """
+
+    def __init__(self, max_mb):
+        self.max_bytes = max_mb * 1024 * 1024
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, boxes, names):
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = (boxes, names)
+            self.nbytes += boxes.nbytes
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                _, (old_boxes, _) = self.entries.popitem(last=False)
+                self.nbytes -= old_boxes.nbytes
+
+
+@st.cache_resource
+def get_prediction_cache():
+    return PredictionCache(PREDICTION_CACHE_MB)
+
+
+@st.cache_data
+def file_digest(image_path, mtime_ns, size):
+    """Content hash of an image file; mtime and size are only part of the cache key."""
+    with open(image_path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def detect_objects(model, model_key, image, image_key, conf_threshold, image_bytes=None, predict_lock=None):
+    """
+    Returns the detections (N, 6 array) above conf_threshold and the class names.
+    model is a local YOLO model, run under predict_lock (see ModelRegistry), or an InferenceClient,
+    which is sent the encoded image_bytes.
+    Inference runs once per (image, model) at CONF_FLOOR; other thresholds only filter the cached boxes.
+    Filtering after NMS keeps exactly the boxes NMS at the higher threshold would keep, since lower-scored
+    boxes never suppress higher-scored ones.
+    """
+    cache = get_prediction_cache()
+    key = (image_key, model_key)
+    entry = cache.get(key)
+    if entry is None:
+        with instrumentation.timer('inference'):
+            if isinstance(model, InferenceClient):
+                entry = model.predict(image_bytes, conf=CONF_FLOOR)
+            else:
+                with predict_lock or nullcontext():
+                    results = model.predict(image, conf=CONF_FLOOR)[0]
+                entry = (results.boxes.data.cpu().numpy(), results.names)
+        instrumentation.count('detections_run')
+        cache.put(key, *entry)
+    else:
+        instrumentation.count('prediction_cache_hits')
+    boxes, names = entry
+    return boxes[boxes[:, 4] >= conf_threshold], names
+
+
+@st.cache_data
+def list_images(image_dir, dir_mtime_ns):
+    """Image files of the folder; relisted only when the folder changes (dir_mtime_ns is part of the cache key)."""
+    return list_image_files(image_dir)
+
+
+def to_bgr(image):
+    """RGB PIL image to the BGR array ultralytics plots on (the same conversion its predictor applies)."""
+    return np.ascontiguousarray(np.asarray(image)[:, :, ::-1])
 
 
-def display_results(results, image_placeholder, caption):
-    """Displays the annotated image."""
-    annotated_image_bgr = results.plot()
-    annotated_image_rgb = annotated_image_bgr[..., ::-1]
+def display_results(image_bgr, boxes, names, image_placeholder, caption):
+    """Draws the detections on the image and displays it."""
+    with instrumentation.timer('render'):
+        results = Results(orig_img=image_bgr, path=caption, names=names, boxes=torch.from_numpy(boxes))
+        annotated_image_bgr = results.plot()
+        annotated_image_rgb = annotated_image_bgr[..., ::-1]
     image_placeholder.image(annotated_image_rgb,
                             caption=caption, use_container_width=True)
 
 
 # --- Path Configuration ---
-MODEL_DIR = os.path.join(os.path.dirname(__file__), "models")
-IMAGE_DIR = os.path.join(os.path.dirname(__file__), "images")
+MODEL_DIR = warmup.MODEL_DIR
+IMAGE_DIR = warmup.IMAGE_DIR
 
 if not os.path.exists(MODEL_DIR):
     st.error(f"Error: The model folder '{MODEL_DIR}' does not exist.")
@@ -61,8 +241,7 @@ if not os.path.exists(IMAGE_DIR):
 try:
     available_models = sorted([os.path.basename(m)
                                for m in glob.glob(f"{MODEL_DIR}/*.pt")])
-    image_paths = sorted(
-        glob.glob(f"{IMAGE_DIR}/*.jpg") + glob.glob(f"{IMAGE_DIR}/*.png"))
+    image_paths = list_images(IMAGE_DIR, os.stat(IMAGE_DIR).st_mtime_ns)
 except Exception as e:
     st.error(f"Error reading folders: {e}")
     st.stop()
@@ -74,6 +253,10 @@ if not image_paths:
     st.error(f"No images found in '{IMAGE_DIR}'.")
     st.stop()
 
+# With an inference server configured at start the local models are only loaded if someone switches back
+model_registry = get_model_registry(tuple(os.path.join(MODEL_DIR, m) for m in available_models),
+                                    COMPARE_WORKERS or len(available_models), preload=not INFERENCE_URL)
+
 # --- Session State Management ---
 if "selected_image_path" not in st.session_state:
     st.session_state.selected_image_path = None
@@ -98,6 +281,99 @@ conf_threshold = st.sidebar.slider(
 
 run_all_models = st.sidebar.checkbox("Show all models' results")
 
+precision = st.sidebar.selectbox(
+    "CPU precision:", PRECISION_MODES,
+    help="bf16 runs the model under bfloat16 autocast, int8 uses a pre-exported OpenVINO INT8 model "
+         "(needs the openvino extra: uv sync --extra openvino)."
+)
+
+inference_url = st.sidebar.text_input(
+    "Inference server URL (optional):", value=INFERENCE_URL,
+    help="Send the images to inference_server.py (fp32, micro-batched) instead of running the models in this app."
+).strip()
+
+input_mode = st.sidebar.radio("Input:", ["Image", "Video / camera"], horizontal=True)
+
+# A rerun interrupts the streaming loop below, so the pipeline of the previous run is stopped here
+if st.session_state.get("video_pipeline"):
+    st.session_state.video_pipeline.stop()
+    st.session_state.video_pipeline = None
+
+
+def video_source_widget():
+    """Sidebar inputs of the video mode; returns a file path, a camera index or a stream URL, or None."""
+    source_type = st.sidebar.radio("Source:", ["Video file", "Camera / stream"], horizontal=True)
+    if source_type == "Camera / stream":
+        source = st.sidebar.text_input("Camera index or stream URL:", value="0").strip()
+        return int(source) if source.isdigit() else source or None
+    video_file = st.sidebar.file_uploader("Upload a video:", type=["mp4", "avi", "mov", "mkv"])
+    # OpenCV reads from a path, so the upload is written once into a directory owned by the session;
+    # the directory is removed when the session is garbage collected or the app exits
+    if "video_dir" not in st.session_state:
+        st.session_state.video_dir = tempfile.TemporaryDirectory(prefix="demo_video_")
+    path = None
+    if video_file:
+        path = os.path.join(st.session_state.video_dir.name,
+                            f"{video_file.file_id}{os.path.splitext(video_file.name)[1]}")
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(video_file.getvalue())
+    # The pipeline of the previous run was stopped above, so replaced or removed uploads can go
+    for name in os.listdir(st.session_state.video_dir.name):
+        old_path = os.path.join(st.session_state.video_dir.name, name)
+        if old_path != path:
+            os.remove(old_path)
+    return path
+
+
+def run_video_mode():
+    source = video_source_widget()
+    st.header("Live Detection")
+    if inference_url:
+        st.info("Video runs on the local models, the inference server is only used for images.")
+    if source is None:
+        st.info("Upload a video or enter a camera to start.")
+        return
+    start_col, stop_col = st.columns(2)
+    if start_col.button("Start", use_container_width=True):
+        st.session_state.video_running = True
+    if stop_col.button("Stop", use_container_width=True):
+        st.session_state.video_running = False
+    if not st.session_state.get("video_running"):
+        return
+
+    model = load_model(os.path.join(MODEL_DIR, model_choice), precision)
+    if not model:
+        return
+    pipeline = VideoPipeline(source, model, conf_threshold, INFERENCE_SIZE,
+                             model_registry.predict_lock(os.path.join(MODEL_DIR, model_choice), precision)).start()
+    st.session_state.video_pipeline = pipeline
+    stats_placeholder = st.empty()
+    frame_placeholder = st.empty()
+    while True:
+        item = pipeline.output.get(timeout=1.0)
+        if item is None:
+            # A closed output returns None at once, so waiting on it again would spin
+            if pipeline.output.closed or pipeline.error is not None or not pipeline.running:
+                break
+            continue
+        frame_rgb, stats = item
+        frame_placeholder.image(frame_rgb, use_container_width=True)
+        stats_placeholder.markdown(f"**{stats['fps']:.1f} FPS** | latency {stats['latency_ms']:.0f} ms | "
+                                   f"{stats['processed']} frames processed, {stats['dropped']} stale frames dropped")
+    pipeline.stop()
+    st.session_state.video_running = False
+    st.session_state.video_pipeline = None
+    if pipeline.error:
+        st.error(pipeline.error)
+    else:
+        st.success("Video finished.")
+
+
+if input_mode == "Video / camera":
+    run_video_mode()
+    st.stop()
+
 uploaded_file = st.sidebar.file_uploader(
     "Upload a new image:",
     type=["jpg", "jpeg", "png"]
@@ -106,9 +382,12 @@ uploaded_file = st.sidebar.file_uploader(
 # --- Main App Logic ---
 
 # Handle file uploader logic and update session state
-if uploaded_file:
+# The uploader keeps returning the file on every rerun; only a new upload is read and hashed
+if uploaded_file and uploaded_file.file_id != st.session_state.get("uploaded_file_id"):
     # Get uploaded file data and store it in session state
+    st.session_state.uploaded_file_id = uploaded_file.file_id
     st.session_state.uploaded_file_data = uploaded_file.getvalue()
+    st.session_state.uploaded_file_digest = hashlib.sha1(st.session_state.uploaded_file_data).hexdigest()
     st.session_state.selected_image_path = None  # Reset thumbnail selection
     # Reset pointer after reading to allow other operations
     uploaded_file.seek(0)
@@ -116,18 +395,43 @@ if uploaded_file:
 # Determine the image to process based on current session state
 image_to_process = None
 image_caption = ""
+image_key = None
+image_bytes = None
+original_size = None
 
 if st.session_state.uploaded_file_data:
-    # Use the uploaded file data from session state
-    image_to_process = Image.open(BytesIO(st.session_state.uploaded_file_data))
+    # Use the uploaded file data from session state, decoded once per content hash
+    image_key = st.session_state.uploaded_file_digest
+    image_to_process, original_size = decode_upload(image_key, st.session_state.uploaded_file_data)
     image_caption = "Uploaded Image"
 elif st.session_state.selected_image_path:
     # Use the selected thumbnail image
-    image_to_process = load_image(st.session_state.selected_image_path)
+    try:
+        stat = os.stat(st.session_state.selected_image_path)
+        image_to_process, original_size = load_image(st.session_state.selected_image_path, stat.st_mtime_ns)
+        image_key = file_digest(st.session_state.selected_image_path, stat.st_mtime_ns, stat.st_size)
+    except Exception as e:
+        st.error(f"Error loading image '{st.session_state.selected_image_path}': {e}")
+        image_to_process = None
     image_caption = f"Selected Image from Folder: {os.path.basename(st.session_state.selected_image_path)}"
+if image_to_process and original_size != image_to_process.size:
+    image_caption += f" ({original_size[0]}x{original_size[1]}, shown at {image_to_process.width}x{image_to_process.height})"
+if image_to_process and inference_url:
+    image_bytes = encode_image(image_key, image_to_process)
+
+
+def model_key(model_name):
+    # Remote predictions come from the server's fp32 models, they must not share cache entries with local ones
+    return (model_name, "remote") if inference_url else (model_name, precision)
+
+
+def model_lock(model_name):
+    return None if inference_url else model_registry.predict_lock(os.path.join(MODEL_DIR, model_name), precision)
+
 
 # Display selected or uploaded image and its detection result
 if image_to_process and model_choice:
+    image_bgr = to_bgr(image_to_process)
     # Logic for showing all models or a single model
     if run_all_models:
         st.header("Original Image")
@@ -138,21 +442,45 @@ if image_to_process and model_choice:
         cols_per_row = 2
         cols = st.columns(cols_per_row)
 
+        # Start any missing loads (on the registry's load pool) before the comparisons that wait on them
+        model_futures = {} if inference_url else {
+            model_name: model_registry.get(os.path.join(MODEL_DIR, model_name), precision)
+            for model_name in available_models}
+
+        def compare_model(model_name):
+            if inference_url:
+                model = InferenceClient(inference_url, model_name)
+            else:
+                model = model_futures[model_name].result()
+            return detect_objects(model, model_key(model_name), image_to_process, image_key, conf_threshold, image_bytes,
+                                  model_lock(model_name))
+
+        # Lay out every column first, then fill each one as soon as its model finishes
+        placeholders = {}
         for i, model_name in enumerate(available_models):
             with cols[i % cols_per_row]:
                 st.subheader(model_name)
-                model = load_model(os.path.join(MODEL_DIR, model_name))
-                if model:
-                    with st.spinner(f"Running detection with {model_name}..."):
-                        results = detect_objects(
-                            model, image_to_process, conf_threshold)
-                        display_results(results, st.empty(),
-                                        f"Result from {model_name}")
-                else:
-                    st.warning(f"Could not load model: {model_name}")
+                placeholders[model_name] = st.empty()
+                placeholders[model_name].info(f"Running detection with {model_name}...")
+
+        with instrumentation.timer('compare', models=len(available_models)):
+            futures = {model_registry.submit(compare_model, model_name): model_name
+                       for model_name in available_models}
+            for future in as_completed(futures):
+                model_name = futures[future]
+                try:
+                    boxes, names = future.result()
+                except Exception as e:
+                    placeholders[model_name].warning(f"Could not run model {model_name}: {e}")
+                    continue
+                display_results(image_bgr, boxes, names, placeholders[model_name],
+                                f"Result from {model_name}")
 
     else:  # Single model display
-        model = load_model(os.path.join(MODEL_DIR, model_choice))
+        if inference_url:
+            model = InferenceClient(inference_url, model_choice)
+        else:
+            model = load_model(os.path.join(MODEL_DIR, model_choice), precision)
 
         if model:
             col1, col2 = st.columns(2)
@@ -167,15 +495,24 @@ if image_to_process and model_choice:
                 progress_bar_placeholder = st.empty()
                 progress_bar_placeholder.info(
                     "Running object detection... Please wait.")
-                results = detect_objects(
-                    model, image_to_process, conf_threshold)
-                display_results(results, st.empty(),
-                                f"Result from {model_choice}")
+                try:
+                    boxes, names = detect_objects(
+                        model, model_key(model_choice), image_to_process, image_key, conf_threshold, image_bytes,
+                        model_lock(model_choice))
+                except OSError as e:  # URLError/HTTPError from the inference server
+                    st.error(f"Inference server error: {e}")
+                else:
+                    display_results(image_bgr, boxes, names, st.empty(),
+                                    f"Result from {model_choice}")
                 progress_bar_placeholder.empty()
 
 # --- Thumbnail Section ---
 st.markdown("---")
 st.header("Or select an image from the folder:")
+# Only the current page is thumbnailed and sent to the browser
+num_pages = (len(image_paths) + THUMBNAILS_PER_PAGE - 1) // THUMBNAILS_PER_PAGE
+page = st.number_input(f"Page (of {num_pages})", min_value=1, max_value=num_pages, value=1, step=1) if num_pages > 1 else 1
+page_start = (page - 1) * THUMBNAILS_PER_PAGE
 cols = st.columns(6)
 
 
@@ -187,12 +524,11 @@ def on_thumbnail_click(image_path):
     # The logic at the top of the script will pick up the new state.
 
 
-for i, image_path in enumerate(image_paths):
-    with cols[i % 6]:
+for i, image_path in enumerate(image_paths[page_start:page_start + THUMBNAILS_PER_PAGE], start=page_start):
+    with cols[(i - page_start) % 6]:
         with st.container(border=True):
             try:
-                image = Image.open(image_path)
-                image.thumbnail((150, 150))
+                image = thumbnail_path(image_path, THUMBNAIL_DIR)
 
                 MAX_LENGTH = 30
                 caption = (os.path.basename(image_path)[
@@ -216,3 +552,5 @@ for i, image_path in enumerate(image_paths):
 
 if not st.session_state.uploaded_file_data and not st.session_state.selected_image_path:
     st.info("Please select an image or upload one to get started.")
+
+instrumentation.count('script_runs')
@@ -0,0 +1,62 @@
+import argparse
+import json
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class InferenceClient:
+    """Client of one model on inference_server.py."""
+
+    def __init__(self, url, model_name, timeout=60):
+        self.url = url.rstrip('/')
+        self.model_name = model_name
+        self.timeout = timeout
+
+    def predict(self, image_bytes, conf=0.25):
+        """Returns the (N, 6) xyxy/conf/class detections of an encoded image and the class names."""
+        request = urllib.request.Request(f"{self.url}/predict/{self.model_name}?conf={conf}", data=image_bytes,
+                                         headers={'Content-Type': 'application/octet-stream'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            payload = json.load(response)
+        boxes = np.asarray(payload['boxes'], dtype=np.float32).reshape(-1, 6)
+        # JSON object keys are strings, ultralytics uses int class ids
+        return boxes, {int(k): v for k, v in payload['names'].items()}
+
+
+def get_json(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return json.load(response)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test for inference_server.py: concurrent requests, throughput and batch sizes.")
+    parser.add_argument('--url', default="http://localhost:8000")
+    parser.add_argument('--model', required=True, help="Model file name, e.g. best.pt")
+    parser.add_argument('--image', required=True)
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as f:
+        data = f.read()
+    client = InferenceClient(args.url, args.model)
+    before = get_json(f"{args.url}/stats").get(args.model, {})
+
+    def timed_request(_):
+        start = time.perf_counter()
+        client.predict(data)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        latencies = sorted(executor.map(timed_request, range(args.requests)))
+    elapsed = time.perf_counter() - start
+    after = get_json(f"{args.url}/stats")[args.model]
+
+    batches = after['batches'] - before.get('batches', 0)
+    print(f"{args.requests} requests, concurrency {args.concurrency}: {args.requests / elapsed:.1f} req/s, "
+          f"latency p50 {latencies[len(latencies) // 2] * 1000:.0f} ms, p90 {latencies[int(len(latencies) * 0.9)] * 1000:.0f} ms")
+    print(f"Server ran {batches} forward passes (mean batch size {args.requests / max(batches, 1):.2f})")
@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+
+import instrumentation
+from cpu_precision import PRECISION_MODES
+from warmup import MODEL_DIR, load_and_warm_model
+
+# HTTP inference service for the models in models/, with dynamic micro-batching:
+#   GET  /models                          -> {"models": [...]}
+#   POST /predict/<model>?conf=0.25       body: encoded jpg/png -> {"boxes": [[x1, y1, x2, y2, conf, cls], ...], "names": {...}}
+#   GET  /stats                           -> requests, batches and mean batch size per model
+# Concurrent requests for a model are queued and run as one forward pass of up to --max-batch images,
+# waiting at most --max-wait-ms after the first request for more to arrive.
+
+
+class MicroBatcher:
+    """
+    Collects requests for one model into batches on a single thread, which is also the only thread
+    that touches the model. A batch closes when it holds max_batch images or max_wait seconds after its first one.
+    """
+
+    def __init__(self, name, model, max_batch=8, max_wait=0.01):
+        self.name = name
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.requests = 0
+        self.batches = 0
+        threading.Thread(target=self._run, name=f"batcher-{name}", daemon=True).start()
+
+    def submit(self, image, conf) -> Future:
+        """Future of the (N, 6) xyxy/conf/class detections of a BGR image above conf."""
+        future = Future()
+        self.queue.put((image, conf, future))
+        return future
+
+    def _collect(self) -> list:
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Requests cancelled by a handler that gave up waiting are dropped, the rest can no longer be cancelled
+            batch = [request for request in self._collect() if request[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            # Any error fails the pending requests of this batch, the thread keeps serving the next ones
+            try:
+                # One pass at the lowest requested confidence, each request then gets its own threshold
+                conf = min(c for _, c, _ in batch)
+                with instrumentation.timer('inference', model=self.name):
+                    results = self.model.predict([image for image, _, _ in batch], conf=conf, verbose=False)
+                self.requests += len(batch)
+                self.batches += 1
+                instrumentation.observe('batch_size', len(batch), model=self.name)
+                for (_, c, future), result in zip(batch, results):
+                    boxes = result.boxes.data.cpu().numpy()
+                    future.set_result(boxes[boxes[:, 4] >= c])
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def stats(self) -> dict:
+        return {'requests': self.requests, 'batches': self.batches,
+                'mean_batch_size': self.requests / self.batches if self.batches else 0.0}
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    # Set by serve(): model name -> MicroBatcher, model name -> class names, seconds a request waits for its batch
+    batchers = {}
+    names = {}
+    request_timeout = 30.0
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip('/')
+        if path == '/models':
+            self._send_json(200, {'models': sorted(self.batchers)})
+        elif path == '/stats':
+            self._send_json(200, {name: b.stats() for name, b in self.batchers.items()})
+        else:
+            self._send_json(404, {'error': f"Unknown path {path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'predict':
+            self._send_json(404, {'error': f"Unknown path {url.path}"})
+            return
+        model_name = parts[1]
+        if model_name not in self.batchers:
+            self._send_json(404, {'error': f"Unknown model {model_name}"})
+            return
+        try:
+            conf = float(parse_qs(url.query).get('conf', ['0.25'])[0])
+            data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            # Decoded on the request thread, so the batcher thread only runs the model
+            image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                raise ValueError("Body is not a decodable image")
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        start = time.perf_counter()
+        future = self.batchers[model_name].submit(image, conf)
+        try:
+            boxes = future.result(timeout=self.request_timeout)
+        except TimeoutError:
+            future.cancel()
+            self._send_json(504, {'error': f"No result within {self.request_timeout:.0f} s"})
+            return
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+        self._send_json(200, {'model': model_name, 'boxes': boxes.tolist(), 'names': self.names[model_name],
+                              'latency_ms': (time.perf_counter() - start) * 1000})
+
+    def log_message(self, format, *args):
+        pass  # one line per request would dominate the output under load
+
+
+def serve(port=8000, address="0.0.0.0", model_dir=MODEL_DIR, precision="fp32", max_batch=8, max_wait_ms=10.0,
+          request_timeout=30.0):
+    InferenceHandler.request_timeout = request_timeout
+    for model_file in sorted(os.listdir(model_dir)):
+        if not model_file.endswith(".pt"):
+            continue
+        try:
+            model = load_and_warm_model(os.path.join(model_dir, model_file), precision)
+        except Exception as e:
+            print(f"Error loading model {model_file}: {e}. Skipping this model.")
+            continue
+        InferenceHandler.batchers[model_file] = MicroBatcher(model_file, model, max_batch, max_wait_ms / 1000)
+        InferenceHandler.names[model_file] = model.names
+    print(f"Serving {len(InferenceHandler.batchers)} models on {address}:{port} "
+          f"(max batch {max_batch}, max wait {max_wait_ms:.0f} ms)")
+    server = ThreadingHTTPServer((address, port), InferenceHandler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    for name, batcher in InferenceHandler.batchers.items():
+        stats = batcher.stats()
+        print(f"{name}: {stats['requests']} requests in {stats['batches']} batches (mean batch size {stats['mean_batch_size']:.2f})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="HTTP inference service for the demo models with dynamic micro-batching.")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--address', default="0.0.0.0")
+    parser.add_argument('--models-dir', default=MODEL_DIR)
+    parser.add_argument('--precision', choices=PRECISION_MODES, default="fp32",
+                        help="CPU inference precision. int8 needs the openvino extra (uv sync --extra openvino).")
+    parser.add_argument('--max-batch', type=int, default=8, help="Most images per forward pass.")
+    parser.add_argument('--max-wait-ms', type=float, default=10.0,
+                        help="How long a batch waits after its first request for more to arrive.")
+    parser.add_argument('--request-timeout', type=float, default=30.0,
+                        help="Seconds a request waits for its result before the server answers 504.")
+    args = parser.parse_args()
+    instrumentation.configure(job="inference-server")
+    serve(args.port, args.address, args.models_dir, args.precision, args.max_batch, args.max_wait_ms,
+          args.request_timeout)
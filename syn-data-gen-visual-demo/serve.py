@@ -0,0 +1,29 @@
+import time
+
+PROCESS_START = time.perf_counter()
+
+import argparse
+import os
+
+import warmup
+
+# Starts the demo with its warmup: the readiness endpoint and the warmup thread come up first, then Streamlit
+# runs app.py in this same process, so the app finds the models the warmup has loaded (see warmup.pending_model).
+# `streamlit run app.py` still works, the models are then loaded on the first session instead.
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the demo with model/thumbnail warmup and a readiness endpoint.")
+    parser.add_argument('--port', type=int, default=8501, help="Streamlit port.")
+    parser.add_argument('--address', default="0.0.0.0")
+    parser.add_argument('--ready-port', type=int, default=int(os.environ.get("READY_PORT", "8502")),
+                        help="Port of the GET /ready endpoint (503 until the warmup is done).")
+    args = parser.parse_args()
+
+    warmup.serve_readiness(args.ready_port, args.address)
+    warmup.start(process_start=PROCESS_START)
+
+    from streamlit.web import bootstrap
+
+    flag_options = {'server_port': args.port, 'server_address': args.address}
+    bootstrap.load_config_options(flag_options=flag_options)
+    bootstrap.run(os.path.join(warmup.APP_DIR, "app.py"), False, [], flag_options)
@@ -0,0 +1,38 @@
+import glob
+import hashlib
+import os
+import threading
+
+from PIL import Image
+
+import instrumentation
+
+THUMBNAIL_SIZE = (150, 150)
+THUMBNAIL_DIR = os.environ.get("THUMBNAIL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".thumbnails"))
+
+
+def list_image_files(image_dir):
+    return sorted(glob.glob(f"{image_dir}/*.jpg") + glob.glob(f"{image_dir}/*.png"))
+
+
+def thumbnail_path(image_path, thumbnail_dir=THUMBNAIL_DIR):
+    """
+    Cached thumbnail of an image, generated on first use into thumbnail_dir.
+    The file name hashes path, mtime and size, so a changed image gets a new thumbnail.
+    """
+    stat = os.stat(image_path)
+    key = hashlib.sha1(f"{os.path.abspath(image_path)}|{stat.st_mtime_ns}|{stat.st_size}".encode()).hexdigest()
+    cached = os.path.join(thumbnail_dir, f"{key}.jpg")
+    if not os.path.exists(cached):
+        with instrumentation.timer('preprocess', op='thumbnail'):
+            image = Image.open(image_path)
+            image.draft("RGB", THUMBNAIL_SIZE)  # JPEGs decode directly at a reduced scale
+            image = image.convert("RGB")
+            image.thumbnail(THUMBNAIL_SIZE)
+            os.makedirs(thumbnail_dir, exist_ok=True)
+            # Written under a temporary name first, so concurrent sessions never read a partial file
+            tmp = f"{cached}.{os.getpid()}.{threading.get_ident()}.tmp"
+            image.save(tmp, "JPEG", quality=85)
+            os.replace(tmp, cached)
+        instrumentation.count('thumbnails_generated')
+    return cached
@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+
+import cv2
+
+import instrumentation
+
+
+class LatestFrame:
+    """
+    One-slot mailbox between two threads: put() replaces an item that was not taken yet (counted in `dropped`),
+    get() waits for a new one. A slow consumer therefore always gets the newest frame instead of a backlog.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.item = None
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        with self.cond:
+            if self.item is not None:
+                self.dropped += 1
+            self.item = item
+            self.cond.notify_all()
+
+    def get(self, timeout=None):
+        """The newest item, or None on timeout or once closed and drained."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.item is not None or self.closed, timeout)
+            item, self.item = self.item, None
+            return item
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class VideoPipeline:
+    """
+    Live detection on a video file, camera index or stream URL with two threads:
+    a decode thread puts every frame (with its capture time) into a LatestFrame, and the inference thread
+    takes the newest one, so frames that arrive while the model is busy are dropped rather than queued.
+    Annotated RGB frames and their stats go into `output`. Files are played at their own frame rate, like a camera.
+    predict_lock is held around every inference when the model is shared with other threads.
+    """
+
+    def __init__(self, source, model, conf=0.25, inference_size=640, predict_lock=None):
+        self.source = source
+        self.model = model
+        self.predict_lock = predict_lock or threading.Lock()
+        self.conf = conf
+        self.inference_size = inference_size
+        self.frames = LatestFrame()
+        self.output = LatestFrame()
+        self.stop_event = threading.Event()
+        self.error = None
+        self.processed = 0
+        self.fps = 0.0
+        self.latency_ms = 0.0
+        self.threads = []
+
+    def start(self):
+        self.threads = [threading.Thread(target=self._decode, name="video-decode", daemon=True),
+                        threading.Thread(target=self._infer, name="video-infer", daemon=True)]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.frames.close()
+        for thread in self.threads:
+            thread.join(timeout=2)
+        self.output.close()
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    def _decode(self):
+        capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            self.error = f"Could not open video source {self.source}"
+            self.frames.close()
+            return
+        # Cameras deliver frames in real time by themselves, files are paced to their frame rate
+        is_file = isinstance(self.source, str) and os.path.isfile(self.source)
+        frame_interval = 1 / (capture.get(cv2.CAP_PROP_FPS) or 30) if is_file else 0
+        next_frame = time.perf_counter()
+        try:
+            while not self.stop_event.is_set():
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                self.frames.put((time.perf_counter(), frame))
+                if frame_interval:
+                    next_frame += frame_interval
+                    time.sleep(max(0.0, next_frame - time.perf_counter()))
+        finally:
+            capture.release()
+            self.frames.close()
+
+    def _infer(self):
+        last_done = None
+        try:
+            while not self.stop_event.is_set():
+                item = self.frames.get(timeout=0.5)
+                if item is None:
+                    if self.frames.closed:
+                        break
+                    continue
+                captured, frame = item
+                height, width = frame.shape[:2]
+                scale = self.inference_size / max(height, width)
+                if scale < 1:
+                    # Downscaled once here, so neither the model's letterbox nor the plot work at full resolution
+                    frame = cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+                with self.predict_lock, instrumentation.timer('inference', op='video'):
+                    results = self.model.predict(frame, conf=self.conf, verbose=False)[0]
+                annotated = results.plot()
+                done = time.perf_counter()
+                self.processed += 1
+                self.latency_ms = (done - captured) * 1000
+                if last_done is not None:
+                    # Exponential moving average, so the number is readable but still follows changes within a second
+                    self.fps = 0.9 * self.fps + 0.1 / (done - last_done) if self.fps else 1 / (done - last_done)
+                last_done = done
+                self.output.put((annotated[..., ::-1], self.stats()))
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            # Also stops the decode thread, so `running` turns False once inference has ended for any reason
+            self.stop_event.set()
+            self.frames.close()
+            self.output.close()
+
+    def stats(self) -> dict:
+        return {'fps': self.fps, 'latency_ms': self.latency_ms, 'processed': self.processed,
+                'dropped': self.frames.dropped}
@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import instrumentation
+from thumbnails import THUMBNAIL_DIR, list_image_files, thumbnail_path
+
+# Cold-start warmup for the demo: imports, model loads, first inferences and thumbnails.
+# serve.py runs it in the Streamlit server process, so app.py picks the warmed models up from here.
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(APP_DIR, "models")
+IMAGE_DIR = os.path.join(APP_DIR, "images")
+WARMUP_SIZE = 640
+
+# (model_path, precision) -> Future of the warmed model, registered before the loads start
+_models = {}
+_lock = threading.Lock()
+status = {'ready': False, 'error': None, 'timings': {}}
+
+
+def load_and_warm_model(model_path, precision="fp32", timings=None):
+    """
+    Loads a model in the given CPU precision and runs one dummy inference, so the first real one is not slowed by
+    lazy init (kernel selection, allocator growth). Durations in seconds go into `timings` if given.
+    """
+    import numpy as np
+    from cpu_precision import load_cpu_precision_model
+
+    name = os.path.basename(model_path)
+    start = time.perf_counter()
+    with instrumentation.timer('model_load', model=name):
+        # int8 needs the <model>_int8_openvino_model export next to the checkpoint (see cpu_precision.py)
+        model = load_cpu_precision_model(model_path, precision)
+    loaded = time.perf_counter()
+    with instrumentation.timer('warmup', model=name):
+        model.predict(np.zeros((WARMUP_SIZE, WARMUP_SIZE, 3), dtype=np.uint8), verbose=False)
+    if timings is not None:
+        timings[f"model_load.{name}"] = loaded - start
+        timings[f"first_inference.{name}"] = time.perf_counter() - loaded
+    return model
+
+
+def pending_model(model_path, precision):
+    """Future of a model the warmup loads (or loaded), None if it is not part of the warmup."""
+    with _lock:
+        return _models.get((model_path, precision))
+
+
+def warm_thumbnails(image_dir=IMAGE_DIR, thumbnail_dir=THUMBNAIL_DIR) -> int:
+    image_paths = list_image_files(image_dir)
+    for image_path in image_paths:
+        try:
+            thumbnail_path(image_path, thumbnail_dir)
+        except Exception as e:
+            print(f"Could not create thumbnail for {image_path}: {e}")
+    return len(image_paths)
+
+
+def run_warmup(model_dir=MODEL_DIR, image_dir=IMAGE_DIR, precision="fp32", process_start=None) -> dict:
+    """
+    Warms everything the first request would otherwise pay for, in order: heavy imports, every model's load
+    and first inference, the thumbnail cache. Returns the duration of each step in seconds; `total` is measured
+    from process_start (a perf_counter value) if given, so it includes the interpreter start-up before the call.
+    """
+    start = time.perf_counter()
+    timings = {}
+    # Registered before the slow imports, so a session starting meanwhile waits for these models instead of
+    # loading its own copies
+    model_paths = sorted(os.path.join(model_dir, m) for m in os.listdir(model_dir) if m.endswith(".pt"))
+    with _lock:
+        futures = {path: _models.setdefault((path, precision), Future()) for path in model_paths}
+
+    imports_start = time.perf_counter()
+    try:
+        import torch  # noqa: F401
+        import ultralytics  # noqa: F401
+    except Exception as e:
+        for future in futures.values():
+            if not future.done():
+                future.set_exception(e)
+        raise
+    timings['imports'] = time.perf_counter() - imports_start
+
+    for path, future in futures.items():
+        if future.done():
+            continue
+        try:
+            future.set_result(load_and_warm_model(path, precision, timings))
+        except Exception as e:
+            print(f"Error warming up model {path}: {e}. Skipping this model.")
+            future.set_exception(e)
+
+    thumbnails_start = time.perf_counter()
+    warm_thumbnails(image_dir)
+    timings['thumbnails'] = time.perf_counter() - thumbnails_start
+    timings['total'] = time.perf_counter() - (start if process_start is None else process_start)
+    for step, seconds in timings.items():
+        instrumentation.gauge('cold_start_seconds', seconds, step=step)
+    return timings
+
+
+def start(model_dir=MODEL_DIR, image_dir=IMAGE_DIR, process_start=None) -> threading.Thread:
+    """Runs the warmup on a background thread and flips status['ready'] when it is done."""
+
+    def target():
+        try:
+            status['timings'] = run_warmup(model_dir, image_dir, process_start=process_start)
+            print_breakdown(status['timings'])
+        except Exception as e:
+            status['error'] = str(e)
+            print(f"Warmup failed: {e}")
+        status['ready'] = True
+
+    thread = threading.Thread(target=target, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+class ReadinessHandler(BaseHTTPRequestHandler):
+    """GET /ready: 200 with the cold-start breakdown once the warmup is done, 503 before or if it failed."""
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/ready':
+            self.send_error(404)
+            return
+        body = json.dumps(status).encode()
+        # A failed warmup also ends with ready set, it must not pass the health check
+        self.send_response(200 if status['ready'] and not status['error'] else 503)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # probes every few seconds would flood the server log
+
+
+def serve_readiness(port: int, address: str = "0.0.0.0") -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((address, port), ReadinessHandler)
+    threading.Thread(target=server.serve_forever, name="readiness", daemon=True).start()
+    return server
+
+
+def print_breakdown(timings: dict):
+    print("\n--- Cold start ---")
+    for step, seconds in timings.items():
+        print(f"  {step:40s} {seconds:8.2f} s")
+
+
+if __name__ == '__main__':
+    process_start = time.perf_counter()
+    parser = argparse.ArgumentParser(description="Measure (or prepare) the demo's cold start: imports, model loads, first inferences, thumbnails.")
+    parser.add_argument('--models-dir', default=MODEL_DIR)
+    parser.add_argument('--images-dir', default=IMAGE_DIR)
+    parser.add_argument('--thumbnails-only', action='store_true', help="Only fill the thumbnail cache (used at image build time).")
+    parser.add_argument('--out', default=None, help="Write the breakdown as JSON.")
+    parser.add_argument('--baseline', default=None, help="Breakdown JSON of an earlier run to compare against.")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Relative slowdown reported as a regression.")
+    parser.add_argument('--fail-on-regression', action='store_true', help="Exit with status 1 on a regression.")
+    args = parser.parse_args()
+
+    if args.thumbnails_only:
+        count = warm_thumbnails(args.images_dir)
+        print(f"Thumbnail cache ready for {count} images in {THUMBNAIL_DIR}")
+        sys.exit(0)
+
+    # Run as a fresh process this measures a true cold start, the same steps serve.py runs before the app is ready
+    timings = run_warmup(args.models_dir, args.images_dir, process_start=process_start)
+    print_breakdown(timings)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(timings, f, indent=2)
+        print(f"\nSaved breakdown to {args.out}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        # Every step is a duration, so only slowdowns count as regressions
+        regressions = instrumentation.compare_to_baseline(
+            [(step, seconds, baseline.get(step), False) for step, seconds in timings.items()], args.tolerance, 40, ' s')
+        if regressions and args.fail_on_regression:
+            print(f"\nRegressions: {', '.join(regressions)}")
+            sys.exit(1)
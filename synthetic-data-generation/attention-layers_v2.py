@@ -1,324 +1,172 @@
-import cv2
-import numpy as np
-import csv
 from ultralytics import YOLO
 from yolo_cam.eigen_cam import EigenCAM
-from yolo_cam.utils.image import show_cam_on_image
-from PIL import Image
 import os
 import warnings
 import argparse
-from collections import defaultdict # To easily manage metrics
+from cam_capture import SVD_METHODS, MultiLayerEigenCAM, iter_image_batches, resolve_target_layers
+from attention_metrics import compute_box_coverage, compute_center_distance
+from attention_sweep import record_image_layers, run_parallel
+from image_cache import DecodedImageCache
+from label_index import YoloLabelIndex
+from attention_results import DetailCsvWriter, summarize_detail_csv
+from cam_viz import VIZ_MODES, CamVisualizationWriter
+from cam_store import CamStoreWriter
+from cpu_precision import enable_bf16
+import instrumentation
 
 warnings.filterwarnings("ignore")
 
-# Metrics functions
-def compute_box_coverage(cam: np.ndarray, boxes: list) -> float:
-    """
-    Computes the proportion of CAM mass that falls within the ground truth bounding boxes.
-    """
-    if not boxes: # Handle cases where there are no ground truth boxes
-        return 0.0
-    
-    cam_norm = cam.astype(np.float32)
-    # Normalize CAM to sum to 1 for meaningful proportion
-    cam_norm /= (cam_norm.sum() + 1e-8)
-    
-    in_box_mass = 0.0
-    for x1, y1, x2, y2 in boxes:
-        # Ensure coordinates are within image bounds
-        x1, y1 = max(0, int(x1)), max(0, int(y1))
-        x2, y2 = min(cam_norm.shape[1], int(x2)), min(cam_norm.shape[0], int(y2))
-        
-        if x2 > x1 and y2 > y1: # Ensure valid box
-            in_box_mass += cam_norm[y1:y2, x1:x2].sum()
-            
-    return in_box_mass
-
-def compute_center_distance(cam: np.ndarray, boxes: list) -> float:
-    """
-    Computes the average normalized Euclidean distance between the center of mass
-    of the CAM and the center of each ground truth bounding box.
-    """
-    if not boxes: # Handle cases where there are no ground truth boxes
-        return 0.0
-        
-    H, W = cam.shape
-    ys, xs = np.indices((H, W))
-    
-    mass = cam.astype(np.float32)
-    total_mass = mass.sum() + 1e-8
-    
-    # Compute center of mass of the CAM
-    com_x = (xs * mass).sum() / total_mass
-    com_y = (ys * mass).sum() / total_mass
-    
-    dists = []
-    for x1, y1, x2, y2 in boxes:
-        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
-        
-        # Calculate Euclidean distance
-        dist = np.hypot(com_x - cx, com_y - cy)
-        
-        # Normalize by the diagonal length of the bounding box
-        # This makes the distance scale-invariant
-        box_diagonal = np.hypot(x2 - x1, y2 - y1)
-        if box_diagonal > 1e-8: # Avoid division by zero
-            dists.append(dist / box_diagonal)
-        else: # Handle tiny or invalid boxes gracefully
-            dists.append(0.0)
-            
-    return float(np.mean(dists)) if dists else 0.0
 
 def load_yolo_labels(images_dir: str, labels_dir: str, target_size=(800,600)) -> dict:
     """
     Loads YOLO format labels and converts them to pixel coordinates relative to target_size.
+    Image sizes and boxes come from the persistent YoloLabelIndex, so only new or changed files are read.
     """
-    annots = {}
-    for fn in os.listdir(images_dir):
-        base, ext = os.path.splitext(fn)
-        if ext.lower() not in ['.jpg', '.png', '.jpeg']:
-            continue
-        
-        img_path = os.path.join(images_dir, fn)
-        # Use PIL for robust image loading to get original size
-        with Image.open(img_path) as img_pil:
-            w0, h0 = img_pil.size
-        
-        sx, sy = target_size[0] / w0, target_size[1] / h0 # Scaling factors for resizing
+    return YoloLabelIndex(images_dir, labels_dir).scaled_boxes(target_size)
+
+def parse_model_configs(model_paths: list) -> list:
+    """'path:name' or 'path' (named after the file) -> [{'path', 'name'}]"""
+    model_configs = []
+    for m in model_paths:
+        if ':' in m:
+            path, name = m.split(':', 1)
+        else:
+            path = m
+            name = os.path.splitext(os.path.basename(path))[0]
+        model_configs.append({'path': path, 'name': name})
+    return model_configs
 
-        boxes = []
-        lp = os.path.join(labels_dir, base + '.txt')
-        if os.path.exists(lp):
-            with open(lp, 'r') as f:
-                for line in f:
-                    parts = line.strip().split()
-                    if len(parts) != 5:
-                        continue
-                    _, xc_norm, yc_norm, w_norm, h_norm = map(float, parts)
-                    
-                    # Convert normalized YOLO format to pixel coordinates in original image
-                    xc, yc = xc_norm * w0, yc_norm * h0
-                    w, h = w_norm * w0, h_norm * h0
-                    
-                    x1, y1 = xc - w/2, yc - h/2
-                    x2, y2 = xc + w/2, yc + h/2
-                    
-                    # Scale coordinates to the target_size for consistency with CAM
-                    boxes.append([x1 * sx, y1 * sy, x2 * sx, y2 * sy])
-        annots[fn] = boxes
-    return annots
 
-def process_single_image(model, img_path: str, target_layer, boxes: list, exp_name: str, layer_identifier: str, metrics: dict):
+def process_single_image(model, img_path: str, target_layer, boxes: list, exp_name: str, layer_identifier: str, metrics,
+                         image_cache: DecodedImageCache, viz: CamVisualizationWriter, cam_store: CamStoreWriter = None):
     """
-    Processes a single image, generates CAM, computes metrics, and saves the visualization.
+    Per-layer capture of one image: runs yolo_cam's EigenCAM on target_layer, records the metrics
+    and, if the image is rendered, a separate detection pass for the overlay.
     """
     try:
-        img = cv2.imread(img_path)
-        if img is None:
+        resized_img = image_cache.get(img_path)
+        if resized_img is None:
             print(f"Warning: Could not read image {img_path}. Skipping.")
             return
 
-        resized_img = cv2.resize(img, (800, 600))
-        inp_for_cam = resized_img.astype(np.float32) / 255.0 # For `show_cam_on_image`
+        with instrumentation.timer('cam', layer=layer_identifier):
+            cam_extractor = EigenCAM(model, [target_layer], task='od')
+            cam_map = cam_extractor(resized_img)[0]
 
-        cam_extractor = EigenCAM(model, [target_layer], task='od')
-        cam_map = cam_extractor(resized_img)[0] # Assuming batch size 1, take the first CAM map
+        with instrumentation.timer('attention_metrics'):
+            coverage = compute_box_coverage(cam_map, boxes)
+            center_dist = compute_center_distance(cam_map, boxes)
 
-        # Compute metrics
-        coverage = compute_box_coverage(cam_map, boxes)
-        center_dist = compute_center_distance(cam_map, boxes)
-        
-        metrics[exp_name].append({'layer': layer_identifier, 'coverage': coverage, 'dist': center_dist})
+        metrics[exp_name].append({'layer': layer_identifier, 'coverage': coverage, 'dist': center_dist, 'image_filename': os.path.basename(img_path)})
+        if cam_store is not None:
+            cam_store.add(exp_name, os.path.basename(img_path), layer_identifier, cam_map)
 
-        # Generate and save CAM visualization
-        cam_img = show_cam_on_image(inp_for_cam, cam_map, use_rgb=True)
-        
-        # Overlay predicted boxes from YOLO
-        # Note: model(resized_img) will perform inference on the resized image
-        results = model(resized_img, verbose=False) # Add verbose=False to suppress print output
-        if results and results[0].boxes:
-            for x1, y1, x2, y2 in results[0].boxes.xyxy:
-                cv2.rectangle(cam_img, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
-        
-        out_dir = f"cam_results_{exp_name}"
-        os.makedirs(out_dir, exist_ok=True)
-        # Use layer_identifier in the filename
-        out_path = os.path.join(out_dir, f"{os.path.basename(img_path).replace('.', '_')}_L{layer_identifier}.jpg")
-        cv2.imwrite(out_path, cam_img)
+        # The extra detection pass is only needed for the overlay, skip both when this image is not rendered
+        if viz.wants(os.path.basename(img_path)):
+            with instrumentation.timer('inference'):
+                results = model(resized_img, verbose=False)
+            pred_boxes = results[0].boxes.xyxy if results and results[0].boxes else []
+            out_dir = f"cam_results_{exp_name}"
+            os.makedirs(out_dir, exist_ok=True)
+            out_path = os.path.join(out_dir, f"{os.path.basename(img_path).replace('.', '_')}_L{layer_identifier}.jpg")
+            viz.submit(out_path, image_cache.get_float(img_path), cam_map, pred_boxes)
         print(f"Processed {os.path.basename(img_path)} with layer {layer_identifier}. Cov: {coverage:.3f}, Dist: {center_dist:.3f}")
 
     except Exception as e:
         print(f"Error processing {img_path} with layer {layer_identifier} for model {exp_name}: {e}")
 
 
-def doMultiScale(model_paths: list, images_dir: str, labels_dir: str, layers_to_analyze: list, device: str):
+def doMultiScale(args: argparse.Namespace, image_cache: DecodedImageCache, viz: CamVisualizationWriter):
     """
-    Main function to run CAM analysis for multiple models and layers.
+    Runs the CAM analysis for every model and layer in `args` (the parsed command line) and writes
+    attention_metrics_detail.csv and attention_metrics_summary.csv.
+    Frames are read through image_cache, overlays go to viz.
     """
-    # Parse models: allow 'path:name' or 'path'
-    model_configs = []
-    for m in model_paths:
-        if ':' in m:
-            path, name = m.split(':', 1)
-        else:
-            path = m
-            name = os.path.splitext(os.path.basename(path))[0]
-        model_configs.append({'path': path, 'name': name})
+    model_configs = parse_model_configs(args.models)
+    layers_to_analyze = args.layers
+    svd_args = (args.svd, args.svd_iters, args.svd_tol)
+    # Recorded with every row and stored map; per-layer capture is yolo_cam's EigenCAM, the same maps as 'exact'
+    svd_name = args.svd if args.capture == 'single-pass' else 'exact'
+    cam_store_args = (args.cam_store, (800, 600), args.cam_store_downsample, svd_name) if args.cam_store else None
 
-    # Use defaultdict to easily append metric values
-    metrics = defaultdict(list)
-    
-    print(f"Loading annotations from {labels_dir} for images in {images_dir}...")
-    annotations = load_yolo_labels(images_dir, labels_dir)
-    print(f"Loaded {len(annotations)} images with annotations.")
+    csv_path_summary = 'attention_metrics_summary.csv'
+    csv_path_detail = 'attention_metrics_detail.csv'
+    # Rows are streamed to the detail CSV as they are computed instead of being kept in memory
+    metrics = DetailCsvWriter(csv_path_detail, args.resume, svd_name)
+    # Parallel workers open their own store writers
+    cam_store = CamStoreWriter(*cam_store_args) if cam_store_args and args.workers <= 1 else None
 
-    for config in model_configs:
-        model_path = config['path']
-        exp_name = config['name']
-        print(f"\n--- Processing Model: {exp_name} ({model_path}) ---")
-        try:
-            model = YOLO(model_path).to(device)
-            # Ensure model is in evaluation mode for consistent behavior
-            model.eval() 
-        except Exception as e:
-            print(f"Error loading model {model_path}: {e}. Skipping this model.")
-            continue
+    print(f"Loading annotations from {args.labels} for images in {args.images}...")
+    annotations = load_yolo_labels(args.images, args.labels)
+    print(f"Loaded {len(annotations)} images with annotations.")
 
-        for fn, boxes in annotations.items():
-            img_path = os.path.join(images_dir, fn)
-            
-            # Dynamically get the layer object based on the index
-            for idx in layers_to_analyze:
-                target_layer = None
-                layer_identifier = str(idx) # Default identifier
-                
-                # Special handling for the C2PSA Attention module
-                if idx == 10:
+    if args.workers > 1:
+        run_parallel(model_configs, args.images, annotations, layers_to_analyze, args.device, args.workers, metrics,
+                     image_cache.cache_dir, args.image_cache_mb,
+                     is_done=lambda exp_name, fn: metrics.is_done(exp_name, fn, layers_to_analyze),
+                     viz_args=(args.viz, args.viz_sample_rate, args.viz_threads), cam_store_args=cam_store_args,
+                     svd_args=svd_args, metrics_out=args.metrics_out,
+                     share_models=not args.no_share_models, precision=args.precision,
+                     image_cache_disk_mb=args.image_cache_disk_mb)
+    else:
+        for config in model_configs:
+            model_path = config['path']
+            exp_name = config['name']
+            print(f"\n--- Processing Model: {exp_name} ({model_path}) ---")
+            try:
+                with instrumentation.timer('model_load'):
+                    model = YOLO(model_path).to(args.device)
+                    model.eval()
+            except Exception as e:
+                print(f"Error loading model {model_path}: {e}. Skipping this model.")
+                continue
+            target_layers = resolve_target_layers(model, layers_to_analyze, exp_name)
+
+            if args.capture == 'single-pass':
+                if args.precision == 'bf16':
+                    enable_bf16(model)
+                # Hook all layers once and get every CAM plus the detections from one forward per image
+                # With --batch-size > 1 the images of a batch share one forward pass and one batched SVD per layer
+                cam_capture = MultiLayerEigenCAM(model, target_layers, *svd_args)
+                img_paths = [os.path.join(args.images, fn) for fn in annotations
+                             if not metrics.is_done(exp_name, fn, layers_to_analyze)]
+                for paths, imgs in iter_image_batches(img_paths, args.batch_size, loader=image_cache.get):
                     try:
-                        # Direct access to the Attention module within PSABlock
-                        target_layer = model.model.model[10].m[0].attn 
-                        layer_identifier = '10_C2PSA_Attention'
-                        print(f"Targeting explicit attention layer: {layer_identifier}")
+                        if len(imgs) == 1:
+                            cams, results = cam_capture(imgs[0])
+                            cams = [cams]
+                        else:
+                            cams, results = cam_capture.batch(imgs)
                     except Exception as e:
-                        print(f"Could not access C2PSA Attention module at model.model.model[10].m[0].attn: {e}")
-                        print("Falling back to C2PSA main block (layer 10) if available for CAM.")
-                        target_layer = model.model.model[10] # Fallback to the whole C2PSA block
-                        layer_identifier = '10_C2PSA_Block'
-                else:
-                    try:
-                        target_layer = model.model.model[idx]
-                        print(f"Targeting backbone/neck layer: model.model.model[{idx}]")
-                    except IndexError:
-                        print(f"Warning: Layer index {idx} not found in model {exp_name}. Skipping.")
+                        print(f"Error capturing CAMs for batch starting at {paths[0]} for model {exp_name}: {e}")
                         continue
-                
-                if target_layer:
-                    process_single_image(model, img_path, target_layer, boxes, exp_name, layer_identifier, metrics)
-
-    # Print summary and write CSV
-    print("\n--- Attention Metrics Summary ---")
-    summary_rows = []
-    detail_rows = []
-
-    for exp_name, vals in metrics.items():
-        if not vals:
-            print(f"No metrics recorded for experiment: {exp_name}")
-            continue
-
-        # Group by layer for mean calculations
-        layers_data = defaultdict(lambda: defaultdict(list))
-        for v in vals:
-            layers_data[v['layer']]['coverage'].append(v['coverage'])
-            layers_data[v['layer']]['dist'].append(v['dist'])
-            detail_rows.append({
-                'experiment': exp_name,
-                'image_filename': v.get('image_filename', 'N/A'), # if you added this to process_single_image
-                'layer': v['layer'],
-                'coverage': v['coverage'],
-                'center_dist': v['dist']
-            })
-
-        # Overall mean
-        all_covs = [v['coverage'] for v in vals]
-        all_dists = [v['dist'] for v in vals]
-        if all_covs and all_dists:
-            mean_cov_all = np.mean(all_covs)
-            mean_dist_all = np.mean(all_dists)
-            num_samples_all = len(vals)
-            print(f"Experiment: {exp_name} | Overall Mean Coverage: {mean_cov_all:.3f} | Overall Mean Distance: {mean_dist_all:.3f} | Samples: {num_samples_all}")
-            summary_rows.append({
-                'experiment': exp_name,
-                'layer': 'ALL_LAYERS_MEAN',
-                'coverage': mean_cov_all,
-                'center_dist': mean_dist_all,
-                'num_samples': num_samples_all
-            })
-
-        # Mean per layer
-        print(f"  --- Mean Metrics per Layer for {exp_name} ---")
-        for layer_id, data in sorted(layers_data.items()):
-            mean_cov_layer = np.mean(data['coverage'])
-            mean_dist_layer = np.mean(data['dist'])
-            num_samples_layer = len(data['coverage'])
-            print(f"    Layer: {layer_id} | Mean Coverage: {mean_cov_layer:.3f} | Mean Distance: {mean_dist_layer:.3f} | Samples: {num_samples_layer}")
-            summary_rows.append({
-                'experiment': exp_name,
-                'layer': layer_id,
-                'coverage': mean_cov_layer,
-                'center_dist': mean_dist_layer,
-                'num_samples': num_samples_layer
-            })
-
-    csv_path_summary = 'attention_metrics_summary.csv'
-    csv_path_detail = 'attention_metrics_detail.csv'
+                    for img_path, img, img_cams, img_results in zip(paths, imgs, cams, results):
+                        inp_for_cam = image_cache.get_float(img_path) if viz.wants(os.path.basename(img_path)) else None
+                        record_image_layers(img_path, img, img_cams, img_results, annotations[os.path.basename(img_path)], exp_name, metrics,
+                                            inp_for_cam, viz, cam_store)
+                cam_capture.release()
+                continue
 
-    # Write summary CSV
-    if summary_rows:
-        summary_fieldnames = ['experiment', 'layer', 'coverage', 'center_dist', 'num_samples']
-        with open(csv_path_summary, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=summary_fieldnames)
-            writer.writeheader()
-            writer.writerows(summary_rows)
-        print(f"\nSaved summary metrics CSV to {csv_path_summary}")
+            for fn, boxes in annotations.items():
+                img_path = os.path.join(args.images, fn)
+                for layer_identifier, target_layer in target_layers:
+                    if metrics.is_done(exp_name, fn, [layer_identifier.split('_')[0]]):
+                        continue
+                    process_single_image(model, img_path, target_layer, boxes, exp_name, layer_identifier, metrics,
+                                         image_cache, viz, cam_store)
 
-    # Write detailed CSV (if needed, otherwise you can remove this)
-    # The current `metrics` structure needs to store image filename for this
-    # For simplicity, if you only want mean values, the summary is sufficient.
-    # If you want detailed per-image, per-layer data, you need to extend the `metrics` dict storage in `process_single_image`
-    # For now, `detail_rows` is built directly from appending to the `metrics` list, which has the necessary info.
-    if detail_rows:
-        detail_fieldnames = ['experiment', 'layer', 'coverage', 'center_dist'] # Assuming no image_filename stored yet
-        # To include image_filename in detail_rows, modify process_single_image to include it in the dict appended to metrics.
-        # e.g., metrics[exp_name].append({'layer': layer_identifier, 'coverage': coverage, 'dist': center_dist, 'image_filename': os.path.basename(img_path)})
-        # Then, modify the detail_fieldnames and the loop that creates detail_rows.
-        
-        # Current implementation of `detail_rows` relies on `v.get('image_filename', 'N/A')`, meaning it expects it.
-        # Let's adjust `process_single_image` to store it.
-        fieldnames_for_detail_csv = ['experiment', 'layer', 'image_filename', 'coverage', 'center_dist']
-        
-        # Re-collect detail_rows with image_filename after adjusting `process_single_image` to include it.
-        # This part of the code needs to be re-run or the `metrics` structure needs adjustment to save `image_filename`
-        # Let's re-structure how `metrics` is filled in `process_single_image` to be complete.
-        re_collected_detail_rows = []
-        for exp_name, vals in metrics.items():
-            for v in vals:
-                re_collected_detail_rows.append({
-                    'experiment': exp_name,
-                    'image_filename': v.get('image_filename', 'N/A'),
-                    'layer': v['layer'],
-                    'coverage': v['coverage'],
-                    'center_dist': v['dist']
-                })
+    viz.close()
+    if cam_store is not None:
+        cam_store.close()
+    metrics.close()
+    print(image_cache.stats())
+    print(f"Wrote {metrics.rows_written} new rows to {csv_path_detail}")
 
-        with open(csv_path_detail, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames_for_detail_csv)
-            writer.writeheader()
-            writer.writerows(re_collected_detail_rows)
-        print(f"Saved detailed metrics CSV to {csv_path_detail}")
+    # The summary is rebuilt from the detail file, so resumed runs summarize old and new rows alike
+    summarize_detail_csv(csv_path_detail, csv_path_summary)
 
 
-if __name__ == '__main__':
+def main():
     parser = argparse.ArgumentParser(description="Generate and analyze attention maps for YOLOv11m models.")
     parser.add_argument('--models', nargs='+', required=True, 
                         help="Paths to YOLOv11m models. Can be 'path/to/model.pt' or 'path/to/model.pt:model_name'.")
@@ -334,194 +182,66 @@ if __name__ == '__main__':
                              "16, 19, 22 (Outputs feeding into detection heads for different scales).")
     parser.add_argument('--device', default='cpu', 
                         help="Device to run inference on (e.g., 'cpu', 'cuda:0').")
+    parser.add_argument('--capture', choices=['single-pass', 'per-layer'], default='single-pass',
+                        help="'single-pass' hooks all layers and computes every CAM and the detections from one forward pass per image. "
+                             "'per-layer' runs a separate EigenCAM and detection pass for each layer (slower, original behaviour).")
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help="Number of images stacked into one forward pass and one batched EigenCAM projection "
+                             "(only used with --capture single-pass).")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of worker processes. The (model, image) pairs are sharded across a process pool, "
+                             "each worker loads every model once, and results are merged in the serial order "
+                             "(single-pass capture, one image per forward).")
+    parser.add_argument('--precision', choices=['fp32', 'bf16'], default='fp32',
+                        help="Numeric precision of the CPU forward pass (single-pass capture only). 'bf16' runs it under bfloat16 "
+                             "autocast, check the accuracy impact with `python -m cpu_precision` first.")
+    parser.add_argument('--no-share-models', action='store_true',
+                        help="With --workers > 1, let every worker load its own copy of each model instead of loading and fusing "
+                             "them once in the parent and sharing the weights with the forked workers (CPU only).")
+    parser.add_argument('--image-cache', default='.image_cache',
+                        help="Directory for the decoded 800x600 frames, reused by later models and runs. Pass '' to keep them in memory only.")
+    parser.add_argument('--image-cache-mb', type=int, default=512,
+                        help="Memory budget of the in-process LRU of decoded frames (per worker).")
+    parser.add_argument('--image-cache-disk-mb', type=int, default=4096,
+                        help="Size limit of the --image-cache directory; the least recently used frames are deleted beyond it.")
+    parser.add_argument('--resume', action='store_true',
+                        help="Keep the existing attention_metrics_detail.csv, skip (experiment, image, layer) rows it already has "
+                             "and append the missing ones.")
+    parser.add_argument('--viz', choices=VIZ_MODES, default='all',
+                        help="Which CAM overlays to write to cam_results_<exp>/: 'none' (metrics only), "
+                             "'sample' (a fixed subset of images, see --viz-sample-rate) or 'all'.")
+    parser.add_argument('--viz-sample-rate', type=float, default=0.05,
+                        help="Fraction of images rendered with --viz sample. The same images are picked for every model.")
+    parser.add_argument('--viz-threads', type=int, default=2,
+                        help="Background threads rendering and encoding the overlays (0 renders inline).")
+    parser.add_argument('--cam-store', default=None,
+                        help="Directory to persist the raw CAM maps (float16, chunked, memory-mapped) for re-analysis "
+                             "with `python cam_store.py` without running the models again.")
+    parser.add_argument('--cam-store-downsample', type=int, default=1,
+                        help="Integer factor the stored maps are downsampled by (e.g. 4 stores 200x150 maps).")
+    parser.add_argument('--svd', choices=SVD_METHODS, default='exact',
+                        help="How the EigenCAM principal component is computed with --capture single-pass: 'exact' (SVD), "
+                             "'power' (power iteration) or 'randomized' (randomized SVD). The fast methods are much cheaper "
+                             "on the large neck maps, check their accuracy with svd_accuracy_check.py.")
+    parser.add_argument('--svd-iters', type=int, default=None,
+                        help="Maximum power iterations (default 20 for 'power', 2 for 'randomized').")
+    parser.add_argument('--svd-tol', type=float, default=1e-4,
+                        help="Convergence tolerance of 'power': stop once the component moves by less than this.")
+    parser.add_argument('--metrics-out', default=os.environ.get(instrumentation.METRICS_OUT_ENV),
+                        help="Record timings (model load, preprocessing, inference, CAM, rendering, disk I/O), counters and memory "
+                             "and write them to this file at exit: '*.prom' in the Prometheus text format, anything else as JSON lines. "
+                             "Off by default (or set $METRICS_OUT).")
     args = parser.parse_args()
-    
-    # Adjust `process_single_image` to store `image_filename`
-    # This modification must be done before `doMultiScale` is called
-    # To avoid modifying global scope variables or passing extra args,
-    # let's make `process_single_image` return the metric dict, then `doMultiScale` collects it.
-    # Alternatively, ensure the dict in `metrics.append` has `image_filename`.
-    # Let's go with adjusting `process_single_image`'s append directly.
-
-    # Rerun the `process_single_image` logic inside `doMultiScale`
-    # and adjust the `metrics.append` line to include `image_filename`.
-
-    # Final adjustment: `process_single_image` should store image filename.
-    # Let's pass `img_filename` to `process_single_image` and add it to the metrics dict.
-    
-    # Redefine process_single_image slightly for this:
-    def process_single_image_updated(model, img_path: str, target_layer, boxes: list, exp_name: str, layer_identifier: str, metrics: dict):
-        try:
-            img = cv2.imread(img_path)
-            if img is None:
-                print(f"Warning: Could not read image {img_path}. Skipping.")
-                return
-
-            resized_img = cv2.resize(img, (800, 600))
-            inp_for_cam = resized_img.astype(np.float32) / 255.0
-
-            cam_extractor = EigenCAM(model, [target_layer], task='od')
-            cam_map = cam_extractor(resized_img)[0]
-
-            coverage = compute_box_coverage(cam_map, boxes)
-            center_dist = compute_center_distance(cam_map, boxes)
-            
-            # Store image filename as well for detailed CSV
-            metrics[exp_name].append({'layer': layer_identifier, 'coverage': coverage, 'dist': center_dist, 'image_filename': os.path.basename(img_path)})
-
-            cam_img = show_cam_on_image(inp_for_cam, cam_map, use_rgb=True)
-            results = model(resized_img, verbose=False)
-            if results and results[0].boxes:
-                for x1, y1, x2, y2 in results[0].boxes.xyxy:
-                    cv2.rectangle(cam_img, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
-            
-            out_dir = f"cam_results_{exp_name}"
-            os.makedirs(out_dir, exist_ok=True)
-            out_path = os.path.join(out_dir, f"{os.path.basename(img_path).replace('.', '_')}_L{layer_identifier}.jpg")
-            cv2.imwrite(out_path, cam_img)
-            print(f"Processed {os.path.basename(img_path)} with layer {layer_identifier}. Cov: {coverage:.3f}, Dist: {center_dist:.3f}")
-
-        except Exception as e:
-            print(f"Error processing {img_path} with layer {layer_identifier} for model {exp_name}: {e}")
+    if args.precision != 'fp32' and args.capture != 'single-pass':
+        parser.error("--precision bf16 needs --capture single-pass")
+    instrumentation.configure(args.metrics_out)
 
-    # Replace the call inside doMultiScale with this updated function
-    # To avoid re-pasting the whole `doMultiScale` here,
-    # let's make `doMultiScale` accept this `process_single_image_func` as an argument
-    # or just call this updated one.
-    
-    # For now, I'll modify the `doMultiScale` function directly to use `process_single_image_updated`
-    # and then call the updated `doMultiScale`
-    
-    # Re-writing `doMultiScale` to incorporate the `image_filename` logging
-    def doMultiScale_final(model_paths: list, images_dir: str, labels_dir: str, layers_to_analyze: list, device: str):
-        model_configs = []
-        for m in model_paths:
-            if ':' in m:
-                path, name = m.split(':', 1)
-            else:
-                path = m
-                name = os.path.splitext(os.path.basename(path))[0]
-            model_configs.append({'path': path, 'name': name})
+    # Every (model, layer) combination reads its frames from here instead of decoding the file again
+    image_cache = DecodedImageCache(args.image_cache or None, max_mb=args.image_cache_mb,
+                                    max_disk_mb=args.image_cache_disk_mb)
+    viz = CamVisualizationWriter(args.viz, args.viz_sample_rate, args.viz_threads)
+    doMultiScale(args, image_cache, viz)
 
-        metrics = defaultdict(list)
-        
-        print(f"Loading annotations from {labels_dir} for images in {images_dir}...")
-        annotations = load_yolo_labels(images_dir, labels_dir)
-        print(f"Loaded {len(annotations)} images with annotations.")
 
-        for config in model_configs:
-            model_path = config['path']
-            exp_name = config['name']
-            print(f"\n--- Processing Model: {exp_name} ({model_path}) ---")
-            try:
-                model = YOLO(model_path).to(device)
-                model.eval() 
-            except Exception as e:
-                print(f"Error loading model {model_path}: {e}. Skipping this model.")
-                continue
-
-            for fn, boxes in annotations.items():
-                img_path = os.path.join(images_dir, fn)
-                
-                for idx in layers_to_analyze:
-                    target_layer = None
-                    layer_identifier = str(idx)
-                    
-                    if idx == 10:
-                        try:
-                            target_layer = model.model.model[10].m[0].attn 
-                            layer_identifier = '10_C2PSA_Attention'
-                            print(f"Targeting explicit attention layer: {layer_identifier}")
-                        except Exception as e:
-                            print(f"Could not access C2PSA Attention module at model.model.model[10].m[0].attn: {e}")
-                            print("Falling back to C2PSA main block (layer 10) if available for CAM.")
-                            target_layer = model.model.model[10]
-                            layer_identifier = '10_C2PSA_Block'
-                    else:
-                        try:
-                            target_layer = model.model.model[idx]
-                            print(f"Targeting backbone/neck layer: model.model.model[{idx}]")
-                        except IndexError:
-                            print(f"Warning: Layer index {idx} not found in model {exp_name}. Skipping.")
-                            continue
-                    
-                    if target_layer:
-                        process_single_image_updated(model, img_path, target_layer, boxes, exp_name, layer_identifier, metrics)
-
-        print("\n--- Attention Metrics Summary ---")
-        summary_rows = []
-        detail_rows = []
-
-        for exp_name, vals in metrics.items():
-            if not vals:
-                print(f"No metrics recorded for experiment: {exp_name}")
-                continue
-
-            layers_data = defaultdict(lambda: defaultdict(list))
-            for v in vals:
-                layers_data[v['layer']]['coverage'].append(v['coverage'])
-                layers_data[v['layer']]['dist'].append(v['dist'])
-                # Already collected in `metrics` as `image_filename`
-
-            # Overall mean
-            all_covs = [v['coverage'] for v in vals]
-            all_dists = [v['dist'] for v in vals]
-            if all_covs and all_dists:
-                mean_cov_all = np.mean(all_covs)
-                mean_dist_all = np.mean(all_dists)
-                num_samples_all = len(vals)
-                print(f"Experiment: {exp_name} | Overall Mean Coverage: {mean_cov_all:.3f} | Overall Mean Distance: {mean_dist_all:.3f} | Samples: {num_samples_all}")
-                summary_rows.append({
-                    'experiment': exp_name,
-                    'layer': 'ALL_LAYERS_MEAN',
-                    'coverage': mean_cov_all,
-                    'center_dist': mean_dist_all,
-                    'num_samples': num_samples_all
-                })
-
-            print(f"  --- Mean Metrics per Layer for {exp_name} ---")
-            for layer_id, data in sorted(layers_data.items()):
-                mean_cov_layer = np.mean(data['coverage'])
-                mean_dist_layer = np.mean(data['dist'])
-                num_samples_layer = len(data['coverage'])
-                print(f"    Layer: {layer_id} | Mean Coverage: {mean_cov_layer:.3f} | Mean Distance: {mean_dist_layer:.3f} | Samples: {num_samples_layer}")
-                summary_rows.append({
-                    'experiment': exp_name,
-                    'layer': layer_id,
-                    'coverage': mean_cov_layer,
-                    'center_dist': mean_dist_layer,
-                    'num_samples': num_samples_layer
-                })
-            
-            # Populate detail_rows for current experiment
-            for v in vals:
-                detail_rows.append({
-                    'experiment': exp_name,
-                    'image_filename': v['image_filename'],
-                    'layer': v['layer'],
-                    'coverage': v['coverage'],
-                    'center_dist': v['dist']
-                })
-
-
-        csv_path_summary = 'attention_metrics_summary.csv'
-        csv_path_detail = 'attention_metrics_detail.csv'
-
-        if summary_rows:
-            summary_fieldnames = ['experiment', 'layer', 'coverage', 'center_dist', 'num_samples']
-            with open(csv_path_summary, 'w', newline='') as f:
-                writer = csv.DictWriter(f, fieldnames=summary_fieldnames)
-                writer.writeheader()
-                writer.writerows(summary_rows)
-            print(f"\nSaved summary metrics CSV to {csv_path_summary}")
-
-        if detail_rows:
-            detail_fieldnames = ['experiment', 'image_filename', 'layer', 'coverage', 'center_dist']
-            with open(csv_path_detail, 'w', newline='') as f:
-                writer = csv.DictWriter(f, fieldnames=detail_fieldnames)
-                writer.writeheader()
-                writer.writerows(detail_rows)
-            print(f"Saved detailed metrics CSV to {csv_path_detail}")
-
-    # Call the final, adjusted doMultiScale function
-    doMultiScale_final(args.models, args.images, args.labels, args.layers, args.device)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
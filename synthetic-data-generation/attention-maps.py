@@ -5,8 +5,12 @@ from yolo_cam.eigen_cam import EigenCAM
 from yolo_cam.utils.image import show_cam_on_image, scale_cam_image
 import matplotlib.pyplot as plt
 from PIL import Image
+import argparse
 import os
 import warnings
+from cam_capture import MultiLayerEigenCAM, iter_image_batches
+import instrumentation
+from cpu_precision import enable_bf16
 
 warnings.filterwarnings("ignore")
 
@@ -19,23 +23,34 @@ os.environ["ATEN_THREADED_TEST"] = "OFF"
 #
 
 
+def render_overlay(img, grayscale_cam, pred_boxes):
+    """CAM heatmap over the float image with the predicted boxes drawn on it."""
+    with instrumentation.timer('render'):
+        cam_image = show_cam_on_image(img, grayscale_cam, use_rgb=True)
+        for box in pred_boxes:
+            x1, y1, x2, y2 = map(int, box)
+            cv2.rectangle(cam_image, (x1, y1), (x2, y2), (0, 255, 0), 2)
+    return cam_image
+
+
 def process_single_image(model, imagePath, target_layer, layer_index = -2, experiment_name = "", show_bboxes=True, write_to_disk=True):
     """Process a single image with a specific target layer and overlay bounding boxes."""
-    img = cv2.imread(imagePath)
-    img = cv2.resize(img, (800, 600))
-    rgb_img = img.copy()
-    img = np.float32(img) / 255
+    with instrumentation.timer('preprocess'):
+        img = cv2.imread(imagePath)
+        img = cv2.resize(img, (800, 600))
+        rgb_img = img.copy()
+        img = np.float32(img) / 255
 
-    cam = EigenCAM(model, [target_layer], task='od')
-    grayscale_cam = cam(rgb_img)[0, :, :]
-    cam_image = show_cam_on_image(img, grayscale_cam, use_rgb=True)
+    with instrumentation.timer('cam', layer=layer_index):
+        cam = EigenCAM(model, [target_layer], task='od')
+        grayscale_cam = cam(rgb_img)[0, :, :]
 
     # Perform object detection and overlay bounding boxes
+    pred_boxes = []
     if show_bboxes:
-        results = model(rgb_img)[0]
-        for box in results.boxes.xyxy:
-            x1, y1, x2, y2 = map(int, box)
-            cv2.rectangle(cam_image, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        with instrumentation.timer('inference'):
+            pred_boxes = model(rgb_img)[0].boxes.xyxy
+    cam_image = render_overlay(img, grayscale_cam, pred_boxes)
 
     
     if write_to_disk:
@@ -44,7 +59,8 @@ def process_single_image(model, imagePath, target_layer, layer_index = -2, exper
         if not os.path.exists(folder):
             os.makedirs(folder)
         filename = f"{folder}/experiment_{experiment_name}_layer_{layer_index}.jpg"
-        cv2.imwrite(filename, cam_image)
+        with instrumentation.timer('disk_io', op='overlay_write'):
+            cv2.imwrite(filename, cam_image)
         print(f"CAM image saved to {filename}")
     else:
         plt.imshow(cam_image)
@@ -54,8 +70,9 @@ def process_single_image(model, imagePath, target_layer, layer_index = -2, exper
 # multi scale CAM for yolov11 detection model, 16,19,22 represent small, medium, large object detect head of yolov11.
 def doMultiScaleCAM(modelPath, imagePath, modelIndexes=[16, 19, 22], experimentName="default"):
     """Perform multi-scale CAM using multiple target layers."""
-    model = YOLO(modelPath)
-    model = model.cpu()
+    with instrumentation.timer('model_load'):
+        model = YOLO(modelPath)
+        model = model.cpu()
 
     for i in modelIndexes:
         process_single_image(model, imagePath, model.model.model[i],
@@ -72,37 +89,58 @@ def doMultiScaleCAM(modelPath, imagePath, modelIndexes=[16, 19, 22], experimentN
     a.show()
 
 
-# --- Example Usage ---
+def doMultiScaleCAMBatch(modelPath, imagePaths, modelIndexes=[16, 19, 22], experimentName="default", batch_size=8, precision="fp32"):
+    """Multi-scale CAM for many images, one forward pass and one batched projection per batch of images.
+    precision="bf16" runs the forward passes under bfloat16 autocast."""
+    with instrumentation.timer('model_load'):
+        model = YOLO(modelPath)
+        model = model.cpu()
+    if precision == "bf16":
+        enable_bf16(model)
+    cam = MultiLayerEigenCAM(model, [(i, model.model.model[i]) for i in modelIndexes])
+
+    folder = "cam_outputs"
+    os.makedirs(folder, exist_ok=True)
+    for paths, imgs in iter_image_batches(imagePaths, batch_size):
+        cams, results = cam.batch(imgs)
+        for path, rgb_img, img_cams, res in zip(paths, imgs, cams, results):
+            img = np.float32(rgb_img) / 255
+            for layer_index, grayscale_cam in img_cams.items():
+                cam_image = render_overlay(img, grayscale_cam, res.boxes.xyxy)
+                name = os.path.splitext(os.path.basename(path))[0]
+                filename = f"{folder}/experiment_{experimentName}_{name}_layer_{layer_index}.jpg"
+                with instrumentation.timer('disk_io', op='overlay_write'):
+                    cv2.imwrite(filename, cam_image)
+    cam.release()
+
+
 if __name__ == "__main__":
-    image_path = 'microorganism-dataset/ZKW_Data/fg_images_as_bbox/images/Tardigrade_01_0008.png'
-    model_weights = 'best-t1.pt'
-    print(YOLO(model_weights).model)
-    exit(0)
-    layers = [5, 8, 16, 19, 22]
-    doMultiScaleCAM(model_weights,
-                    image_path, layers, experimentName="t1-baseline")
-    model_weights = 'best-t2.1-alpha/results/best.pt'
-    doMultiScaleCAM(model_weights,
-                    image_path, layers, experimentName="t2.1-alpha")
-    model_weights = 'best-t2.2-gauss/results/best.pt'
-    doMultiScaleCAM(model_weights,
-                    image_path, layers, experimentName="t2.2-gauss")
-    model_weights = 'best-t2.3-poisson/results/best.pt'
-    doMultiScaleCAM(model_weights,
-                    image_path, layers, experimentName="t2.3-poisson")
-    model_weights = 'best-t2.4-pyramid/results/best.pt'
-    doMultiScaleCAM(model_weights,
-                    image_path, layers, experimentName="t2.4-pyramid")
-    model_weights = 'best-t3-multi/results/best.pt'
-    doMultiScaleCAM(model_weights,
-                    image_path, layers, experimentName="t3-multi")
-
-    # model_weights = 'best-t1-t4-models/best-t4.pt'
-    # model = YOLO(model_weights)
-    # print(len(model.model.model))  # Check the number of layers in the model
-    # process_single_image(
-    #     model,
-    #     image_path,
-    #     model.model.model[-2],
-    #     image_name="-2",
-    #     show_bboxes=True)
+    parser = argparse.ArgumentParser(description="Multi-scale EigenCAM overlays of a YOLO model, written to cam_outputs/.")
+    parser.add_argument('--model', default='best-t1.pt', help="Model weights.")
+    parser.add_argument('--images', nargs='+',
+                        default=['microorganism-dataset/ZKW_Data/fg_images_as_bbox/images/Tardigrade_01_0008.png'],
+                        help="Images to explain.")
+    parser.add_argument('--layers', nargs='+', type=int, default=[5, 8, 16, 19, 22],
+                        help="Layer indices to compute CAMs for (16, 19, 22 feed the small, medium and large detection heads).")
+    parser.add_argument('--experiment', default='default', help="Name used in the output file names.")
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help="With more than 1, the images are processed in batches of this size: one forward pass and one "
+                             "batched EigenCAM projection per batch for all layers (doMultiScaleCAMBatch). "
+                             "1 runs a separate EigenCAM per image and layer and shows each result (doMultiScaleCAM).")
+    parser.add_argument('--precision', choices=['fp32', 'bf16'], default='fp32',
+                        help="CPU forward pass precision of the batched path.")
+    parser.add_argument('--print-model', action='store_true', help="Only print the model architecture (to pick layer indices).")
+    args = parser.parse_args()
+    if args.precision != 'fp32' and args.batch_size <= 1:
+        parser.error("--precision bf16 needs --batch-size > 1")
+    # Set $METRICS_OUT to record timings (see instrumentation.py)
+    instrumentation.configure()
+
+    if args.print_model:
+        print(YOLO(args.model).model)
+    elif args.batch_size > 1:
+        doMultiScaleCAMBatch(args.model, args.images, args.layers, experimentName=args.experiment,
+                             batch_size=args.batch_size, precision=args.precision)
+    else:
+        for image_path in args.images:
+            doMultiScaleCAM(args.model, image_path, args.layers, experimentName=args.experiment)
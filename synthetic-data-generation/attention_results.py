@@ -0,0 +1,170 @@
+import csv
+import os
+from collections import defaultdict
+
+import instrumentation
+from streaming_stats import StreamingStats
+
+DETAIL_FIELDNAMES = ['experiment', 'image_filename', 'layer', 'coverage', 'center_dist', 'pointing_hit', 'energy_p50', 'energy_p90', 'svd']
+SUMMARY_FIELDNAMES = ['experiment', 'layer', 'coverage', 'center_dist', 'num_samples',
+                      'coverage_std', 'coverage_p50', 'coverage_p90', 'coverage_ci95_low', 'coverage_ci95_high',
+                      'center_dist_std', 'center_dist_p50', 'center_dist_p90', 'center_dist_ci95_low', 'center_dist_ci95_high']
+
+
+def _layer_index(layer_identifier: str) -> str:
+    """'10_C2PSA_Attention' -> '10', '16' -> '16'"""
+    return str(layer_identifier).split('_')[0]
+
+
+class _ExperimentRows:
+    def __init__(self, writer, exp_name: str):
+        self.writer = writer
+        self.exp_name = exp_name
+
+    def append(self, v: dict):
+        self.writer.write_row(self.exp_name, v)
+
+    def extend(self, rows: list):
+        for v in rows:
+            self.writer.write_row(self.exp_name, v)
+
+
+class DetailCsvWriter:
+    """
+    Streams per-image, per-layer metric rows into the detail CSV as soon as they are computed.
+    Used in place of the old `metrics` defaultdict: `metrics[exp_name].append(row)` writes the row.
+    With resume=True the existing file is kept, its (experiment, image, layer) triples are skipped
+    and new rows are appended, so an interrupted sweep or one new model only computes what is missing.
+    `svd` names how the CAMs were computed and is stored on every row; resuming a file written with
+    another method is refused, as their maps are not interchangeable.
+    Only the resumed file's keys are kept for the whole run; duplicates among new rows are tracked for the
+    image being written (rows arrive image by image), so memory does not grow with the sweep.
+    """
+
+    def __init__(self, path: str, resume: bool = False, svd: str = 'exact'):
+        self.path = path
+        self.svd = svd
+        self.done = defaultdict(set)  # (experiment, image_filename) -> {layer_identifier}, from the resumed file
+        self.current_key = None  # (experiment, image_filename) of the rows being written
+        self.current_layers = set()
+        self.rows_written = 0
+        if resume and os.path.exists(path):
+            self._truncate_partial_line()
+        if resume and os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'r', newline='') as f:
+                reader = csv.DictReader(f)
+                if reader.fieldnames != DETAIL_FIELDNAMES:
+                    raise ValueError(f"Cannot resume {path}: it has columns {reader.fieldnames}, expected {DETAIL_FIELDNAMES}")
+                for row in reader:
+                    if row['svd'] != svd:
+                        raise ValueError(f"Cannot resume {path} with --svd {svd}: it has rows computed with '{row['svd']}'")
+                    self.done[(row['experiment'], row['image_filename'])].add(row['layer'])
+            print(f"Resuming {path}: {sum(len(v) for v in self.done.values())} rows already done.")
+            self.file = open(path, 'a', newline='')
+            self.writer = csv.DictWriter(self.file, fieldnames=DETAIL_FIELDNAMES)
+        else:
+            self.file = open(path, 'w', newline='')
+            self.writer = csv.DictWriter(self.file, fieldnames=DETAIL_FIELDNAMES)
+            self.writer.writeheader()
+
+    def _truncate_partial_line(self):
+        # A crash can leave half a row at the end of the file, drop it
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def __getitem__(self, exp_name: str) -> _ExperimentRows:
+        return _ExperimentRows(self, exp_name)
+
+    def is_done(self, exp_name: str, image_filename: str, layers_to_analyze: list) -> bool:
+        """True if every requested layer index already has a row for this image."""
+        done = {_layer_index(layer) for layer in self.done.get((exp_name, image_filename), ())}
+        return all(str(idx) in done for idx in layers_to_analyze)
+
+    def write_row(self, exp_name: str, v: dict):
+        key = (exp_name, v['image_filename'])
+        layer = str(v['layer'])
+        if key != self.current_key:
+            self.current_key, self.current_layers = key, set()
+        if layer in self.current_layers or layer in self.done.get(key, ()):
+            return
+        self.current_layers.add(layer)
+        with instrumentation.timer('disk_io', op='detail_csv'):
+            self.writer.writerow({
+                'experiment': exp_name,
+                'image_filename': v['image_filename'],
+                'layer': v['layer'],
+                'coverage': v['coverage'],
+                'center_dist': v['dist'],
+                # Only recorded by the vectorized metrics engine (single-pass capture)
+                'pointing_hit': v.get('pointing_hit', ''),
+                'energy_p50': v.get('energy_p50', ''),
+                'energy_p90': v.get('energy_p90', ''),
+                'svd': self.svd
+            })
+            # Flushed per row, so a crash loses at most the row being written
+            self.file.flush()
+        self.rows_written += 1
+        instrumentation.count('metric_rows_written')
+
+    def close(self):
+        self.file.close()
+
+
+def summarize_detail_csv(detail_path: str, summary_path: str) -> list:
+    """
+    Per-experiment and per-layer statistics of the detail CSV in one streaming pass: mean, std, p50/p90
+    and the 95% confidence interval of the mean for coverage and center distance.
+    Every (experiment, layer) group keeps a Welford accumulator and a quantile sketch, so memory grows with
+    the number of groups, not with the number of rows. ALL_LAYERS_MEAN is the merge of an experiment's layers.
+    """
+    print("\n--- Attention Metrics Summary ---")
+    if not os.path.exists(detail_path):
+        print(f"No detail metrics found at {detail_path}")
+        return []
+
+    # experiment -> layer -> {'coverage': StreamingStats, 'center_dist': StreamingStats}; dicts keep the first-seen experiment order
+    groups = {}
+    with open(detail_path, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            acc = groups.setdefault(row['experiment'], {}).get(row['layer'])
+            if acc is None:
+                acc = groups[row['experiment']][row['layer']] = {'coverage': StreamingStats(), 'center_dist': StreamingStats()}
+            acc['coverage'].add(float(row['coverage']))
+            acc['center_dist'].add(float(row['center_dist']))
+
+    def summary_row(exp_name, layer, acc):
+        return dict({'experiment': exp_name, 'layer': layer, 'num_samples': acc['coverage'].moments.n},
+                    **acc['coverage'].summary('coverage'), **acc['center_dist'].summary('center_dist'))
+
+    def describe(row):
+        return (f"Coverage: {row['coverage']:.3f} ± {row['coverage_std']:.3f} "
+                f"(95% CI {row['coverage_ci95_low']:.3f}-{row['coverage_ci95_high']:.3f}, p50 {row['coverage_p50']:.3f}, p90 {row['coverage_p90']:.3f}) | "
+                f"Distance: {row['center_dist']:.3f} ± {row['center_dist_std']:.3f} "
+                f"(95% CI {row['center_dist_ci95_low']:.3f}-{row['center_dist_ci95_high']:.3f}, p50 {row['center_dist_p50']:.3f}, p90 {row['center_dist_p90']:.3f}) | "
+                f"Samples: {row['num_samples']}")
+
+    summary_rows = []
+    for exp_name, layers in groups.items():
+        overall = {'coverage': StreamingStats(), 'center_dist': StreamingStats()}
+        for acc in layers.values():
+            overall['coverage'].merge(acc['coverage'])
+            overall['center_dist'].merge(acc['center_dist'])
+        row = summary_row(exp_name, 'ALL_LAYERS_MEAN', overall)
+        print(f"Experiment: {exp_name} | Overall Mean {describe(row)}")
+        summary_rows.append(row)
+
+        print(f"  --- Mean Metrics per Layer for {exp_name} ---")
+        for layer_id, acc in sorted(layers.items()):
+            row = summary_row(exp_name, layer_id, acc)
+            print(f"    Layer: {layer_id} | Mean {describe(row)}")
+            summary_rows.append(row)
+
+    if summary_rows:
+        with open(summary_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDNAMES)
+            writer.writeheader()
+            writer.writerows(summary_rows)
+        print(f"\nSaved summary metrics CSV to {summary_path}")
+    return summary_rows
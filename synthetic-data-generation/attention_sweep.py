@@ -0,0 +1,171 @@
+import multiprocessing
+import os
+import warnings
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+from multiprocessing.util import Finalize
+
+import instrumentation
+from attention_metrics import compute_attention_metrics
+from cam_capture import MultiLayerEigenCAM, resolve_target_layers
+from cam_store import CamStoreWriter
+from cam_viz import CamVisualizationWriter, render_cam_overlay
+from cpu_precision import enable_bf16
+from image_cache import DecodedImageCache
+from shared_models import fork_available, format_memory, get_model, preload_shared_models, print_worker_memory, process_memory
+
+
+def record_image_layers(img_path: str, resized_img: np.ndarray, cams: dict, results, boxes: list, exp_name: str, metrics: dict,
+                        inp_for_cam=None, viz: CamVisualizationWriter = None, cam_store: CamStoreWriter = None):
+    """
+    Computes the metrics of every hooked layer of one already captured image and hands the CAM overlays to `viz`.
+    Without a writer the overlays are rendered synchronously.
+    With a `cam_store` the raw maps are persisted for later re-analysis (cam_store.py).
+    """
+    try:
+        image_filename = os.path.basename(img_path)
+        with instrumentation.timer('attention_metrics'):
+            layer_metrics = compute_attention_metrics(cams, boxes)
+        render = viz is None or viz.wants(image_filename)
+        if render:
+            if inp_for_cam is None:
+                inp_for_cam = resized_img.astype(np.float32) / 255.0
+            pred_boxes = results.boxes.xyxy if results and results.boxes else []
+            out_dir = f"cam_results_{exp_name}"
+            os.makedirs(out_dir, exist_ok=True)
+
+        for layer_identifier, cam_map in cams.items():
+            row = layer_metrics[layer_identifier]
+            coverage, center_dist = row['coverage'], row['dist']
+            metrics[exp_name].append(dict(row, layer=layer_identifier, image_filename=image_filename))
+            if cam_store is not None:
+                cam_store.add(exp_name, image_filename, layer_identifier, cam_map)
+
+            if render:
+                out_path = os.path.join(out_dir, f"{image_filename.replace('.', '_')}_L{layer_identifier}.jpg")
+                if viz is None:
+                    render_cam_overlay(out_path, inp_for_cam, cam_map, pred_boxes)
+                else:
+                    viz.submit(out_path, inp_for_cam, cam_map, pred_boxes)
+            print(f"Processed {image_filename} with layer {layer_identifier}. Cov: {coverage:.3f}, Dist: {center_dist:.3f}")
+
+    except Exception as e:
+        print(f"Error processing {img_path} for model {exp_name}: {e}")
+
+
+# Per-worker state, filled by _init_worker in every pool process
+_worker = {}
+
+
+def _init_worker(device: str, layers_to_analyze: list, num_threads: int, image_cache_dir, image_cache_mb: int, viz_args: tuple, cam_store_args: tuple,
+                 svd_args: tuple = ('exact',), metrics_out: str = None, precision: str = 'fp32', image_cache_disk_mb: int = 4096):
+    warnings.filterwarnings("ignore")
+    # Forked workers inherit the parent's series, start from zero and export to a per-worker file
+    instrumentation.reset()
+    instrumentation.configure(instrumentation.worker_path(metrics_out))
+    if instrumentation.is_enabled():
+        Finalize(instrumentation, instrumentation.export, exitpriority=5)
+    torch.set_num_threads(num_threads)
+    # Runs last, after the writers have drained, so the numbers include everything the worker touched
+    Finalize(None, print_worker_memory, exitpriority=1)
+    _worker['device'] = device
+    _worker['layers'] = layers_to_analyze
+    _worker['svd_args'] = svd_args
+    _worker['precision'] = precision
+    _worker['captures'] = {}
+    # Workers share the on-disk frames, so every image is decoded once across the whole pool
+    _worker['image_cache'] = DecodedImageCache(image_cache_dir, max_mb=image_cache_mb,
+                                                 max_disk_mb=image_cache_disk_mb)
+    _worker['viz'] = CamVisualizationWriter(*viz_args)
+    # Pool workers leave through os._exit, which skips atexit; Finalize still drains the queued overlays
+    Finalize(_worker['viz'], _worker['viz'].close, exitpriority=10)
+    # Every worker writes its own store chunks and index file
+    _worker['cam_store'] = CamStoreWriter(*cam_store_args) if cam_store_args else None
+    if _worker['cam_store'] is not None:
+        Finalize(_worker['cam_store'], _worker['cam_store'].close, exitpriority=10)
+
+
+def _get_capture(model_path: str, exp_name: str):
+    """
+    Takes every model from the parent's shared preload (or loads it once per worker) and keeps its
+    hooked capture around for all later images.
+    A model that fails to load is cached as None so the error is reported only once per worker.
+    """
+    captures = _worker['captures']
+    if model_path not in captures:
+        try:
+            with instrumentation.timer('model_load'):
+                model = get_model(model_path, _worker['device'])
+            if model is None:
+                raise RuntimeError("preloading failed in the parent process")
+            if _worker['precision'] == 'bf16':
+                enable_bf16(model)
+            captures[model_path] = MultiLayerEigenCAM(model, resolve_target_layers(model, _worker['layers'], exp_name),
+                                                       *_worker['svd_args'])
+        except Exception as e:
+            print(f"Error loading model {model_path}: {e}. Skipping this model.")
+            captures[model_path] = None
+    return captures[model_path]
+
+
+def _process_work_item(item: tuple) -> list:
+    model_path, exp_name, img_path, boxes = item
+    cam_capture = _get_capture(model_path, exp_name)
+    if cam_capture is None:
+        return []
+    image_cache = _worker['image_cache']
+    img = image_cache.get(img_path)
+    if img is None:
+        print(f"Warning: Could not read image {img_path}. Skipping.")
+        return []
+    metrics = defaultdict(list)
+    try:
+        cams, results = cam_capture(img)
+    except Exception as e:
+        print(f"Error capturing CAMs for {img_path} for model {exp_name}: {e}")
+        return []
+    viz = _worker['viz']
+    inp_for_cam = image_cache.get_float(img_path) if viz.wants(os.path.basename(img_path)) else None
+    record_image_layers(img_path, img, cams, results[0], boxes, exp_name, metrics, inp_for_cam, viz, _worker['cam_store'])
+    return metrics[exp_name]
+
+
+def run_parallel(model_configs: list, images_dir: str, annotations: dict, layers_to_analyze: list, device: str, workers: int, metrics: dict,
+                 image_cache_dir='.image_cache', image_cache_mb: int = 512, is_done=None, viz_args: tuple = ('all',), cam_store_args: tuple = None,
+                 svd_args: tuple = ('exact',), metrics_out: str = None, share_models: bool = True,
+                 precision: str = 'fp32', image_cache_disk_mb: int = 4096):
+    """
+    Shards the (model, image) work list over a process pool.
+    Results are merged back in the serial model -> image -> layer order, so the CSVs match a serial run.
+    `is_done(exp_name, image_filename)` lets resumed runs leave out pairs that are already complete.
+    `viz_args` / `cam_store_args` are the CamVisualizationWriter / CamStoreWriter arguments of the writers every worker creates,
+    `svd_args` the (svd, svd_iters, svd_tol) of MultiLayerEigenCAM, `metrics_out` the instrumentation output of every worker.
+    With `share_models` every checkpoint is loaded and fused once in this process and the workers are forked,
+    so they all use the same weight pages instead of one copy per worker (see shared_models.py).
+    `precision` 'bf16' runs the forward passes under bfloat16 autocast (cpu_precision.enable_bf16).
+    """
+    work = [(config['path'], config['name'], os.path.join(images_dir, fn), boxes)
+            for config in model_configs
+            for fn, boxes in annotations.items()
+            if is_done is None or not is_done(config['name'], fn)]
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+    # Contiguous chunks keep consecutive images of the same model on the same worker
+    chunksize = max(1, len(work) // (workers * 4))
+    print(f"Processing {len(work)} (model, image) pairs on {workers} workers with {num_threads} torch threads each...")
+    mp_context = None
+    # Only CPU weights can be shared, a process must not fork after initializing CUDA or MPS
+    if share_models and device == 'cpu' and fork_available():
+        preload_shared_models([config['path'] for config in model_configs], device)
+        mp_context = multiprocessing.get_context('fork')
+    elif share_models:
+        print("Warning: Sharing model weights needs device 'cpu' and the 'fork' start method, every worker loads its own copy.")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=_init_worker,
+                             initargs=(device, layers_to_analyze, num_threads, image_cache_dir, image_cache_mb, viz_args, cam_store_args, svd_args,
+                                       metrics_out, precision, image_cache_disk_mb)) as pool:
+        for (model_path, exp_name, _, _), rows in zip(work, pool.map(_process_work_item, work, chunksize=chunksize)):
+            if rows:
+                metrics[exp_name].extend(rows)
+    print(f"Parent {os.getpid()} memory: {format_memory(process_memory())}")
@@ -0,0 +1,256 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import warnings
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+import instrumentation
+from attention_metrics import compute_attention_metrics
+from attention_results import DetailCsvWriter
+from cam_capture import SVD_METHODS, MultiLayerEigenCAM, eigen_cam_from_activations, load_resized, projection_for, resolve_target_layers
+from cam_viz import draw_cam_overlay
+from label_index import YoloLabelIndex
+
+warnings.filterwarnings("ignore")
+
+STAGES = ['decode', 'forward', 'cam', 'metrics', 'overlay', 'write']
+
+
+def _draw_organism(img: np.ndarray, rng, cx: float, cy: float, length: float, angle: float) -> tuple:
+    """
+    Draws a tardigrade-like body (elongated, translucent, darker rim, a few legs) and returns its pixel box.
+    """
+    h, w = img.shape[:2]
+    width = length * rng.uniform(0.3, 0.45)
+    body = np.zeros((h, w), np.float32)
+    cv2.ellipse(body, (int(cx), int(cy)), (int(length / 2), int(width / 2)), angle, 0, 360, 1.0, -1)
+    # Legs on both sides along the body axis
+    rad = np.deg2rad(angle)
+    axis, normal = np.array([np.cos(rad), np.sin(rad)]), np.array([-np.sin(rad), np.cos(rad)])
+    for t in np.linspace(-0.35, 0.35, 4):
+        for side in (-1, 1):
+            p = np.array([cx, cy]) + axis * t * length + normal * side * width * 0.5
+            cv2.ellipse(body, (int(p[0]), int(p[1])), (max(2, int(width * 0.18)), max(1, int(width * 0.1))),
+                        angle + 90, 0, 360, 1.0, -1)
+    body = cv2.GaussianBlur(body, (0, 0), max(1.0, width * 0.05))
+    texture = cv2.resize(rng.uniform(0.6, 1.0, (max(2, h // 16), max(2, w // 16))).astype(np.float32), (w, h))
+    alpha = (body * texture * rng.uniform(0.45, 0.7))[..., None]
+    color = np.array(rng.uniform([60, 90, 100], [110, 140, 150]), np.float32)
+    img[:] = img * (1 - alpha) + color * alpha
+
+    ys, xs = np.nonzero(body > 0.05)
+    return xs.min(), ys.min(), xs.max(), ys.max()
+
+
+def generate_microscope_image(rng, size=(1280, 960), max_objects: int = 4) -> tuple:
+    """
+    One synthetic brightfield-microscope-like BGR image: uneven illumination, vignetting, debris and
+    1..max_objects organisms. Returns (image, [(xc, yc, w, h) normalized YOLO boxes]).
+    """
+    w, h = size
+    base = np.array(rng.uniform([150, 170, 160], [200, 215, 205]), np.float32)
+    illumination = cv2.resize(rng.normal(1.0, 0.06, (6, 8)).astype(np.float32), (w, h), interpolation=cv2.INTER_CUBIC)
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    vignette = 1.0 - 0.35 * (((xx - w / 2) / (w / 2)) ** 2 + ((yy - h / 2) / (h / 2)) ** 2) / 2
+    img = base * (illumination * vignette)[..., None]
+
+    # Mud and debris specks
+    for _ in range(rng.integers(20, 80)):
+        r = int(rng.uniform(1, 6))
+        cv2.circle(img, (int(rng.uniform(0, w)), int(rng.uniform(0, h))), r, tuple(float(c) for c in base * rng.uniform(0.4, 0.8)), -1)
+
+    boxes = []
+    for _ in range(rng.integers(1, max_objects + 1)):
+        length = rng.uniform(0.12, 0.3) * min(w, h)
+        cx, cy = rng.uniform(length / 2, w - length / 2), rng.uniform(length / 2, h - length / 2)
+        x1, y1, x2, y2 = _draw_organism(img, rng, cx, cy, length, rng.uniform(0, 180))
+        boxes.append(((x1 + x2) / 2 / w, (y1 + y2) / 2 / h, (x2 - x1) / w, (y2 - y1) / h))
+
+    img = cv2.GaussianBlur(img, (0, 0), 1.2) + rng.normal(0, 3, (h, w, 1)).astype(np.float32)
+    return np.clip(img, 0, 255).astype(np.uint8), boxes
+
+
+def generate_dataset(data_dir: str, count: int, size=(1280, 960), seed: int = 0) -> tuple:
+    """
+    Writes count synthetic images and their YOLO label files to data_dir/images and data_dir/labels.
+    An existing dataset with the same parameters is reused. Returns (images_dir, labels_dir).
+    """
+    images_dir, labels_dir = os.path.join(data_dir, 'images'), os.path.join(data_dir, 'labels')
+    marker = os.path.join(data_dir, 'dataset.json')
+    params = {'count': count, 'size': list(size), 'seed': seed}
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if json.load(f) == params:
+                return images_dir, labels_dir
+    os.makedirs(images_dir, exist_ok=True)
+    os.makedirs(labels_dir, exist_ok=True)
+    print(f"Generating {count} synthetic {size[0]}x{size[1]} images in {data_dir}...")
+    rng = np.random.default_rng(seed)
+    for i in range(count):
+        img, boxes = generate_microscope_image(rng, size)
+        cv2.imwrite(os.path.join(images_dir, f"synthetic_{i:05d}.jpg"), img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        with open(os.path.join(labels_dir, f"synthetic_{i:05d}.txt"), 'w') as f:
+            for xc, yc, bw, bh in boxes:
+                f.write(f"0 {xc:.6f} {yc:.6f} {bw:.6f} {bh:.6f}\n")
+    with open(marker, 'w') as f:
+        json.dump(params, f)
+    return images_dir, labels_dir
+
+
+def run_benchmark(model_path: str, images_dir: str, labels_dir: str, layers_to_analyze: list, device: str, out_dir: str,
+                  input_size=(800, 600), svd: str = 'exact', viz: bool = True, warmup: int = 1) -> dict:
+    """
+    Runs the single-pass CAM pipeline image by image with every stage timed on its own.
+    The first `warmup` images are processed but not counted, unreadable images are skipped.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    annotations = YoloLabelIndex(images_dir, labels_dir, index_dir=None).scaled_boxes(input_size)
+    load_start = time.perf_counter()
+    model = YOLO(model_path).to(device)
+    model.eval()
+    cam_capture = MultiLayerEigenCAM(model, resolve_target_layers(model, layers_to_analyze, 'bench'))
+    model_load_s = time.perf_counter() - load_start
+    projection = projection_for(svd)
+    metrics = DetailCsvWriter(os.path.join(out_dir, 'attention_metrics_detail.csv'), svd=svd)
+
+    times = {stage: [] for stage in STAGES}
+    wall_start = None
+    processed = 0
+    for fn, boxes in annotations.items():
+        t = {}
+        start = time.perf_counter()
+        img = load_resized(os.path.join(images_dir, fn), input_size)
+        if img is None:
+            print(f"Warning: Could not read image {fn}. Skipping.")
+            continue
+        if processed == warmup:
+            wall_start = start
+        processed += 1
+        inp_for_cam = img.astype(np.float32) / 255.0
+        t['decode'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = cam_capture.forward(img)
+        t['forward'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cams = {layer_id: eigen_cam_from_activations(a.numpy(), input_size, projection)[0]
+                for layer_id, a in cam_capture.activations.items()}
+        t['cam'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        rows = compute_attention_metrics(cams, boxes)
+        t['metrics'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pred_boxes = results[0].boxes.xyxy.cpu().numpy() if results[0].boxes is not None else []
+        overlays = {layer_id: draw_cam_overlay(inp_for_cam, cam_map, pred_boxes) for layer_id, cam_map in cams.items()} if viz else {}
+        t['overlay'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for layer_id, cam_img in overlays.items():
+            cv2.imwrite(os.path.join(out_dir, f"{os.path.splitext(fn)[0]}_layer{layer_id}.jpg"), cam_img)
+        for layer_id, row in rows.items():
+            metrics['bench'].append(dict(row, layer=layer_id, image_filename=fn))
+        t['write'] = time.perf_counter() - start
+
+        if processed > warmup:
+            for stage in STAGES:
+                times[stage].append(t[stage])
+    metrics.close()
+    cam_capture.release()
+
+    num_images = len(times['decode'])
+    wall_s = time.perf_counter() - wall_start if wall_start is not None else 0.0
+    stage_total = sum(sum(v) for v in times.values())
+    return {
+        'config': {'model': model_path, 'layers': layers_to_analyze, 'device': device, 'input_size': list(input_size),
+                   'svd': svd, 'viz': viz, 'warmup': warmup},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'processor': platform.processor(), 'cpu_count': os.cpu_count()},
+        'num_images': num_images,
+        'model_load_s': model_load_s,
+        'wall_s': wall_s,
+        'images_per_s': num_images / wall_s if wall_s > 0 else 0.0,
+        'peak_rss_mb': (instrumentation.peak_rss_bytes() or 0) / 1024 / 1024,
+        'stages': {stage: {'total_s': float(np.sum(v)) if v else 0.0,
+                           'mean_ms': float(np.mean(v)) * 1000 if v else 0.0,
+                           'p50_ms': float(np.percentile(v, 50)) * 1000 if v else 0.0,
+                           'p95_ms': float(np.percentile(v, 95)) * 1000 if v else 0.0,
+                           'share': float(np.sum(v)) / stage_total if stage_total else 0.0}
+                   for stage, v in times.items()},
+    }
+
+
+def print_report(report: dict):
+    print(f"\n--- Benchmark: {report['num_images']} images, {report['wall_s']:.2f}s wall, "
+          f"{report['images_per_s']:.2f} img/s, peak RSS {report['peak_rss_mb']:.0f} MB ---")
+    for stage, s in report['stages'].items():
+        print(f"  {stage:8s} mean {s['mean_ms']:8.1f} ms | p50 {s['p50_ms']:8.1f} ms | p95 {s['p95_ms']:8.1f} ms | {s['share'] * 100:5.1f}%")
+
+
+def baseline_checks(report: dict, baseline: dict) -> list:
+    """
+    (name, current, baseline, higher is better) of every stage, the throughput and the peak RSS,
+    for instrumentation.compare_to_baseline.
+    """
+    if baseline.get('config') != report['config']:
+        print(f"Warning: Baseline was measured with a different config: {baseline.get('config')}")
+    checks = [(f"{stage}.mean_ms", s['mean_ms'], baseline['stages'].get(stage, {}).get('mean_ms'), False)
+              for stage, s in report['stages'].items()]
+    return checks + [('images_per_s', report['images_per_s'], baseline.get('images_per_s'), True),
+                     ('peak_rss_mb', report['peak_rss_mb'], baseline.get('peak_rss_mb'), False)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the attention/CAM pipeline on generated synthetic microscope images.")
+    parser.add_argument('--model', default='yolo11m.pt',
+                        help="Model to benchmark. Named ultralytics weights are downloaded on first use.")
+    parser.add_argument('--layers', nargs='+', type=int, default=[10, 16, 19, 22], help="Layer indices to compute CAMs for.")
+    parser.add_argument('--device', default='cpu', help="Device to run inference on (e.g., 'cpu', 'cuda:0', 'mps').")
+    parser.add_argument('--num-images', type=int, default=20, help="Number of synthetic images to process.")
+    parser.add_argument('--resolution', nargs=2, type=int, default=[1280, 960], metavar=('W', 'H'),
+                        help="Resolution of the generated source images.")
+    parser.add_argument('--input-size', nargs=2, type=int, default=[800, 600], metavar=('W', 'H'),
+                        help="Size the images are resized to before inference (800x600 in attention-layers_v2.py).")
+    parser.add_argument('--svd', choices=SVD_METHODS, default='exact', help="EigenCAM projection method.")
+    parser.add_argument('--no-viz', action='store_true', help="Skip the overlay and overlay write stages.")
+    parser.add_argument('--warmup', type=int, default=1, help="Images processed before timing starts.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic dataset.")
+    parser.add_argument('--data-dir', default='.bench_data', help="Where the synthetic datasets are generated and reused.")
+    parser.add_argument('--out', default='bench_results.json', help="JSON file the results are written to.")
+    parser.add_argument('--baseline', default=None, help="Baseline JSON to compare against.")
+    parser.add_argument('--save-baseline', default=None, help="Also write the results to this baseline JSON.")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Relative change counted as a regression (0.1 = 10%%).")
+    parser.add_argument('--fail-on-regression', action='store_true', help="Exit with status 1 if a regression was found.")
+    args = parser.parse_args()
+
+    num_total = args.num_images + args.warmup
+    data_dir = os.path.join(args.data_dir, f"{num_total}_{args.resolution[0]}x{args.resolution[1]}_{args.seed}")
+    images_dir, labels_dir = generate_dataset(data_dir, num_total, tuple(args.resolution), args.seed)
+    report = run_benchmark(args.model, images_dir, labels_dir, args.layers, args.device, os.path.join(data_dir, 'out'),
+                           tuple(args.input_size), args.svd, not args.no_viz, args.warmup)
+    report['config'].update(num_images=args.num_images, resolution=args.resolution, seed=args.seed)
+    print_report(report)
+
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved benchmark results to {args.out}")
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = instrumentation.compare_to_baseline(baseline_checks(report, json.load(f)), args.tolerance)
+        if regressions:
+            print(f"\nRegressions beyond {args.tolerance * 100:.0f}%: {', '.join(regressions)}")
+            if args.fail_on_regression:
+                sys.exit(1)
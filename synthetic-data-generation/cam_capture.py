@@ -0,0 +1,255 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import instrumentation
+from yolo_cam.utils.image import scale_cam_image
+
+
+def resolve_target_layers(model, layers_to_analyze: list, exp_name: str = "") -> list:
+    """
+    Maps layer indices to (layer_identifier, module) pairs.
+    Index 10 targets the C2PSA attention module and falls back to the whole C2PSA block.
+    """
+    target_layers = []
+    for idx in layers_to_analyze:
+        if idx == 10:
+            try:
+                target_layers.append(('10_C2PSA_Attention', model.model.model[10].m[0].attn))
+                print("Targeting explicit attention layer: 10_C2PSA_Attention")
+            except Exception as e:
+                print(f"Could not access C2PSA Attention module at model.model.model[10].m[0].attn: {e}")
+                print("Falling back to C2PSA main block (layer 10) if available for CAM.")
+                target_layers.append(('10_C2PSA_Block', model.model.model[10]))
+        else:
+            try:
+                target_layers.append((str(idx), model.model.model[idx]))
+                print(f"Targeting backbone/neck layer: model.model.model[{idx}]")
+            except IndexError:
+                print(f"Warning: Layer index {idx} not found in model {exp_name}. Skipping.")
+    return target_layers
+
+
+SVD_METHODS = ['exact', 'power', 'randomized']
+
+
+def orient_projection(projection: np.ndarray) -> np.ndarray:
+    """
+    Fixes the arbitrary sign of (B, ...) principal-component projections: per image, the value with the
+    largest magnitude is made positive. The fast methods apply it, since their iterations follow no sign
+    convention at all.
+    """
+    flat = projection.reshape(len(projection), -1)
+    peak = np.take_along_axis(flat, np.abs(flat).argmax(axis=1)[:, None], axis=1)
+    return np.float32(projection * np.where(peak < 0, -1.0, 1.0).astype(np.float32).reshape((-1,) + (1,) * (projection.ndim - 1)))
+
+
+def batched_2d_projection(activation_batch: np.ndarray) -> np.ndarray:
+    """
+    yolo_cam's get_2d_projection for a whole (B, C, h, w) batch with one stacked SVD call instead of a Python loop.
+    It takes the thin SVD: the right singular vectors (and LAPACK's sign of them) are the same as those of the
+    full_matrices=True call, without building the (h*w, h*w) U that dominates its cost on the large maps.
+    """
+    activation_batch = np.nan_to_num(activation_batch, nan=0.0)
+    B, C = activation_batch.shape[:2]
+    reshaped = activation_batch.reshape(B, C, -1).transpose(0, 2, 1)
+    reshaped = reshaped - reshaped.mean(axis=1, keepdims=True)
+    _, _, VT = np.linalg.svd(reshaped, full_matrices=False)
+    projection = np.einsum('bnc,bc->bn', reshaped, VT[:, 0, :])
+    return np.float32(projection.reshape((B,) + activation_batch.shape[2:]))
+
+
+def eigen_cam_from_activations(activations: np.ndarray, target_size: tuple, projection=batched_2d_projection) -> np.ndarray:
+    """
+    Turns a (B, C, h, w) activation batch into (B, H, W) EigenCAM maps.
+    Mirrors EigenCAM for a single target layer: projection, ReLU, scaling and the final aggregation rescale.
+    """
+    cam = np.maximum(projection(activations), 0)
+    cam = scale_cam_image(cam, target_size)
+    return scale_cam_image(np.maximum(cam, 0))
+
+
+def _centered_rows(activation_batch: np.ndarray) -> np.ndarray:
+    """(B, C, h, w) -> mean-centered (B, h*w, C) float32, the matrix EigenCAM takes the SVD of."""
+    activation_batch = np.nan_to_num(activation_batch, nan=0.0)
+    B, C = activation_batch.shape[:2]
+    reshaped = activation_batch.reshape(B, C, -1).transpose(0, 2, 1).astype(np.float32)
+    return reshaped - reshaped.mean(axis=1, keepdims=True)
+
+
+def _oriented_projection(reshaped: np.ndarray, v: np.ndarray, spatial_shape: tuple) -> np.ndarray:
+    """Projects the rows onto v, reshapes to the map and applies orient_projection."""
+    projection = np.einsum('bnc,bc->bn', reshaped, v)
+    return orient_projection(np.float32(projection.reshape((len(projection),) + tuple(spatial_shape))))
+
+
+def power_2d_projection(activation_batch: np.ndarray, iters: int = 20, tol: float = 1e-4) -> np.ndarray:
+    """
+    Top principal component by power iteration on A^T A, for the whole batch at once.
+    Each step costs two (h*w, C) matrix products instead of a full SVD. Stops after `iters` steps
+    or once no component of the unit vector moves by more than `tol`.
+    """
+    reshaped = _centered_rows(activation_batch)
+    # Start from the row with the most energy, it already points roughly along the top component
+    rows = np.take_along_axis(reshaped, np.einsum('bnc,bnc->bn', reshaped, reshaped).argmax(axis=1)[:, None, None], axis=1)
+    v = rows[:, 0, :]
+    v = v / (np.linalg.norm(v, axis=1, keepdims=True) + 1e-12)
+    for _ in range(iters):
+        w = np.einsum('bnc,bn->bc', reshaped, np.einsum('bnc,bc->bn', reshaped, v))
+        w = w / (np.linalg.norm(w, axis=1, keepdims=True) + 1e-12)
+        delta = np.abs(w - v).max()
+        v = w
+        if delta < tol:
+            break
+    return _oriented_projection(reshaped, v, activation_batch.shape[2:])
+
+
+def randomized_2d_projection(activation_batch: np.ndarray, iters: int = 2, oversample: int = 4, seed: int = 0) -> np.ndarray:
+    """
+    Top principal component by randomized SVD (Halko et al.): a Gaussian sketch of 1 + oversample columns,
+    `iters` re-orthonormalized power iterations, then an exact SVD of the small (k, C) matrix.
+    The sketch uses a fixed seed, so the result is deterministic.
+    """
+    reshaped = _centered_rows(activation_batch)
+    B, _, C = reshaped.shape
+    omega = np.random.default_rng(seed).standard_normal((C, 1 + oversample)).astype(np.float32)
+    Q, _ = np.linalg.qr(reshaped @ omega)
+    for _ in range(iters):
+        Q, _ = np.linalg.qr(reshaped @ (reshaped.transpose(0, 2, 1) @ Q))
+    _, _, VT = np.linalg.svd(Q.transpose(0, 2, 1) @ reshaped, full_matrices=False)
+    return _oriented_projection(reshaped, VT[:, 0, :], activation_batch.shape[2:])
+
+
+def projection_for(method: str = 'exact', iters: int = None, tol: float = 1e-4):
+    """
+    Returns the (B, C, h, w) 2D projection function for an SVD method in SVD_METHODS.
+    'exact' gives the same maps as yolo_cam's EigenCAM, sign included. 'power' and 'randomized' use the sign
+    convention of orient_projection, so where LAPACK's sign differs their maps are inverted; rows and stored
+    maps carry the method name and are never mixed. iters=None uses the method's default.
+    """
+    if method == 'exact':
+        return batched_2d_projection
+    if method == 'power':
+        return lambda a: power_2d_projection(a, iters=20 if iters is None else iters, tol=tol)
+    if method == 'randomized':
+        return lambda a: randomized_2d_projection(a, iters=2 if iters is None else iters)
+    raise ValueError(f"Unknown SVD method '{method}', expected one of {SVD_METHODS}")
+
+
+def load_resized(img_path: str, size=(800, 600)):
+    """
+    Reads an image and resizes it to the CAM input size. Returns None if it cannot be read.
+    """
+    with instrumentation.timer('preprocess'):
+        img = cv2.imread(img_path)
+        if img is None:
+            return None
+        return cv2.resize(img, size)
+
+
+def iter_image_batches(img_paths: list, batch_size: int, size=(800, 600), num_threads: int = 4, loader=None):
+    """
+    Yields (paths, resized_images) batches. Images are decoded on a thread pool
+    and the next batch is decoded while the current one is being processed.
+    `loader(img_path)` replaces the plain decode + resize, e.g. DecodedImageCache.get.
+    Unreadable images are reported and dropped from their batch.
+    """
+    if loader is None:
+        loader = lambda p: load_resized(p, size)
+    chunks = [img_paths[i:i + batch_size] for i in range(0, len(img_paths), batch_size)]
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        pending = [pool.submit(loader, p) for p in chunks[0]] if chunks else []
+        for i, chunk in enumerate(chunks):
+            imgs = [f.result() for f in pending]
+            if i + 1 < len(chunks):
+                pending = [pool.submit(loader, p) for p in chunks[i + 1]]
+            paths, batch = [], []
+            for p, img in zip(chunk, imgs):
+                if img is None:
+                    print(f"Warning: Could not read image {p}. Skipping.")
+                    continue
+                paths.append(p)
+                batch.append(img)
+            if batch:
+                yield paths, batch
+
+
+class MultiLayerEigenCAM:
+    """
+    Hooks every target layer at once, so one YOLO forward pass yields the EigenCAM map
+    of every layer together with the detection results.
+    svd selects how the principal component is computed (see SVD_METHODS and projection_for).
+    """
+
+    def __init__(self, model, target_layers: list, svd: str = 'exact', svd_iters: int = None, svd_tol: float = 1e-4):
+        self.model = model
+        self.target_layers = target_layers
+        self.projection = projection_for(svd, svd_iters, svd_tol)
+        self.activations = {}
+        self.handles = [
+            module.register_forward_hook(self._make_hook(layer_id))
+            for layer_id, module in target_layers
+        ]
+
+    def _make_hook(self, layer_id: str):
+        def hook(module, inputs, output):
+            # Overwrite instead of appending: the predictor's warmup pass fires the hooks too
+            # float() turns bf16 activations (cpu_precision.enable_bf16) into something numpy can read
+            self.activations[layer_id] = output.detach().float().cpu()
+        return hook
+
+    def forward(self, imgs):
+        """
+        Runs the forward pass and returns the detection results; the hooked activations are left in self.activations.
+        """
+        self.activations = {}
+        with instrumentation.timer('inference'):
+            results = self.model(imgs, verbose=False)
+        instrumentation.count('images_inferred', len(imgs) if isinstance(imgs, list) else 1)
+        return results
+
+    def __call__(self, img: np.ndarray):
+        """
+        Runs a single forward pass on a BGR image.
+        Returns ({layer_identifier: cam_map}, detection results).
+        """
+        results = self.forward(img)
+        target_size = (img.shape[1], img.shape[0])
+        cams = {}
+        for layer_id, _ in self.target_layers:
+            if layer_id not in self.activations:
+                print(f"Warning: Layer {layer_id} produced no activations. Skipping.")
+                continue
+            with instrumentation.timer('cam', layer=layer_id):
+                cams[layer_id] = eigen_cam_from_activations(self.activations[layer_id].numpy(), target_size, self.projection)[0]
+        return cams, results
+
+    def batch(self, imgs: list):
+        """
+        Runs one forward pass over a list of same-sized BGR images (stacked into one tensor by the predictor)
+        and one batched EigenCAM projection per layer.
+        Returns ([{layer_identifier: cam_map}, ...], detection results), one entry per image.
+        """
+        start = time.perf_counter()
+        results = self.forward(imgs)
+        forward_time = time.perf_counter() - start
+        target_size = (imgs[0].shape[1], imgs[0].shape[0])
+        cams = [{} for _ in imgs]
+        for layer_id, _ in self.target_layers:
+            if layer_id not in self.activations:
+                print(f"Warning: Layer {layer_id} produced no activations. Skipping.")
+                continue
+            with instrumentation.timer('cam', layer=layer_id):
+                layer_cams = eigen_cam_from_activations(self.activations[layer_id].numpy(), target_size, self.projection)
+            for i, cam_map in enumerate(layer_cams):
+                cams[i][layer_id] = cam_map
+        cam_time = time.perf_counter() - start - forward_time
+        print(f"Batch of {len(imgs)}: forward {forward_time:.2f}s, CAM {cam_time:.2f}s "
+              f"({len(imgs) / (forward_time + cam_time + 1e-8):.1f} img/s)")
+        return cams, results
+
+    def release(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
@@ -0,0 +1,159 @@
+import argparse
+import glob
+import json
+import os
+import time
+import uuid
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+import instrumentation
+from attention_metrics import compute_attention_metrics
+from attention_results import DetailCsvWriter, summarize_detail_csv
+from label_index import YoloLabelIndex
+
+
+class CamStoreWriter:
+    """
+    Persists raw CAM maps as float16 into fixed-size, memory-mapped .npy chunks, indexed by (model, image, layer).
+    Maps can be downsampled by an integer factor before storing (INTER_AREA). `svd` is the method the maps
+    were computed with; like the resolution it is fixed per store.
+    Every writer (one per process) owns its own chunk files and index_<id>.jsonl, so parallel workers
+    and later runs can add to the same store without coordination.
+    """
+
+    def __init__(self, store_dir: str, map_size=(800, 600), downsample: int = 1, svd: str = 'exact', chunk_size: int = 256):
+        self.store_dir = store_dir
+        self.chunk_size = chunk_size
+        self.writer_id = uuid.uuid4().hex[:12]
+        self.shape = (map_size[1] // downsample, map_size[0] // downsample)
+        os.makedirs(store_dir, exist_ok=True)
+
+        meta = {'map_size': list(map_size), 'downsample': downsample, 'shape': list(self.shape), 'dtype': 'float16', 'svd': svd}
+        meta_path = os.path.join(store_dir, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                existing = json.load(f)
+            if existing != meta:
+                raise ValueError(f"CAM store {store_dir} was written with {existing}, cannot add maps with {meta}")
+        else:
+            tmp_path = f"{meta_path}.{self.writer_id}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, meta_path)
+
+        self.index_file = open(os.path.join(store_dir, f"index_{self.writer_id}.jsonl"), 'a')
+        self.chunk = None
+        self.chunk_id = -1
+        self.slot = chunk_size
+
+    def _next_chunk(self):
+        if self.chunk is not None:
+            self.chunk.flush()
+        self.chunk_id += 1
+        self.chunk_name = f"chunk_{self.writer_id}_{self.chunk_id:05d}.npy"
+        self.chunk = np.lib.format.open_memmap(os.path.join(self.store_dir, self.chunk_name), mode='w+',
+                                               dtype=np.float16, shape=(self.chunk_size,) + self.shape)
+        self.slot = 0
+
+    def add(self, exp_name: str, image_filename: str, layer, cam_map: np.ndarray):
+        if self.slot >= self.chunk_size:
+            self._next_chunk()
+        if cam_map.shape != self.shape:
+            cam_map = cv2.resize(cam_map.astype(np.float32), (self.shape[1], self.shape[0]), interpolation=cv2.INTER_AREA)
+        with instrumentation.timer('disk_io', op='cam_store_write'):
+            self.chunk[self.slot] = cam_map
+            self.index_file.write(json.dumps({'experiment': exp_name, 'image_filename': image_filename, 'layer': str(layer),
+                                              'chunk': self.chunk_name, 'slot': self.slot}) + '\n')
+            self.index_file.flush()
+        self.slot += 1
+
+    def close(self):
+        if self.chunk is not None:
+            self.chunk.flush()
+            self.chunk = None
+        self.index_file.close()
+
+
+class CamStore:
+    """
+    Read side of a CAM store. Chunks are memory-mapped read-only and only touched when their maps are read.
+    If a (model, image, layer) was stored more than once, the most recently written map wins.
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        entries = {}
+        index_paths = sorted(glob.glob(os.path.join(store_dir, 'index_*.jsonl')), key=os.path.getmtime)
+        for index_path in index_paths:
+            with open(index_path) as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        continue  # Half-written last line of an interrupted writer
+                    e = json.loads(line)
+                    entries[(e['experiment'], e['image_filename'], e['layer'])] = (e['chunk'], e['slot'])
+        self.entries = entries
+        self._chunks = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _chunk(self, name: str) -> np.ndarray:
+        if name not in self._chunks:
+            self._chunks[name] = np.load(os.path.join(self.store_dir, name), mmap_mode='r')
+        return self._chunks[name]
+
+    def get(self, exp_name: str, image_filename: str, layer) -> np.ndarray:
+        chunk, slot = self.entries[(exp_name, image_filename, str(layer))]
+        return self._chunk(chunk)[slot]
+
+    def iter_images(self):
+        """
+        Yields (experiment, image_filename, {layer: float32 map}) grouped per image,
+        reading the chunks in storage order.
+        """
+        grouped = defaultdict(dict)
+        for (exp_name, image_filename, layer), location in self.entries.items():
+            grouped[(exp_name, image_filename)][layer] = location
+        for (exp_name, image_filename), layers in sorted(grouped.items(), key=lambda kv: min(kv[1].values())):
+            yield exp_name, image_filename, {layer: self._chunk(chunk)[slot].astype(np.float32)
+                                             for layer, (chunk, slot) in layers.items()}
+
+
+def metrics_from_store(store_dir: str, images_dir: str, labels_dir: str, detail_path: str, summary_path: str):
+    """
+    Recomputes the attention metrics of every stored CAM map without running any model.
+    Boxes are read from the labels again (scaled to the stored map resolution), so changed labels or
+    box scaling take effect directly.
+    """
+    start = time.perf_counter()
+    store = CamStore(store_dir)
+    shape = store.meta['shape']
+    annotations = YoloLabelIndex(images_dir, labels_dir).scaled_boxes((shape[1], shape[0]))
+    print(f"Loaded {len(store)} CAM maps from {store_dir} ({shape[1]}x{shape[0]}, downsample {store.meta['downsample']}).")
+
+    metrics = DetailCsvWriter(detail_path, svd=store.meta.get('svd', 'unknown'))
+    for exp_name, image_filename, cams in store.iter_images():
+        if image_filename not in annotations:
+            print(f"Warning: No image/labels for {image_filename} in {images_dir}. Skipping.")
+            continue
+        for layer, row in compute_attention_metrics(cams, annotations[image_filename]).items():
+            metrics[exp_name].append(dict(row, layer=layer, image_filename=image_filename))
+    metrics.close()
+    print(f"Computed {metrics.rows_written} rows in {time.perf_counter() - start:.1f}s, saved to {detail_path}")
+    summarize_detail_csv(detail_path, summary_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recompute attention metrics from a stored CAM map store (no model inference).")
+    parser.add_argument('--store', required=True, help="CAM store directory written by attention-layers_v2.py --cam-store.")
+    parser.add_argument('--images', required=True, help="Directory with the images the maps were computed on.")
+    parser.add_argument('--labels', required=True, help="Directory with the YOLO format label files.")
+    parser.add_argument('--detail', default='attention_metrics_from_store_detail.csv', help="Output detail CSV.")
+    parser.add_argument('--summary', default='attention_metrics_from_store_summary.csv', help="Output summary CSV.")
+    args = parser.parse_args()
+    metrics_from_store(args.store, args.images, args.labels, args.detail, args.summary)
@@ -0,0 +1,83 @@
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import instrumentation
+from yolo_cam.utils.image import show_cam_on_image
+
+VIZ_MODES = ['none', 'sample', 'all']
+
+
+def draw_cam_overlay(inp_for_cam: np.ndarray, cam_map: np.ndarray, pred_boxes) -> np.ndarray:
+    """
+    Draws the CAM heatmap and the predicted boxes over the image.
+    """
+    cam_img = show_cam_on_image(inp_for_cam, cam_map, use_rgb=True)
+    for x1, y1, x2, y2 in pred_boxes:
+        cv2.rectangle(cam_img, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
+    return cam_img
+
+
+def render_cam_overlay(out_path: str, inp_for_cam: np.ndarray, cam_map: np.ndarray, pred_boxes) -> None:
+    """
+    Draws the CAM overlay and writes it as JPEG.
+    """
+    with instrumentation.timer('render'):
+        cam_img = draw_cam_overlay(inp_for_cam, cam_map, pred_boxes)
+    with instrumentation.timer('disk_io', op='overlay_write'):
+        cv2.imwrite(out_path, cam_img)
+    instrumentation.count('overlays_written')
+
+
+class CamVisualizationWriter:
+    """
+    Renders and writes CAM overlays on a background thread pool so the inference loop never waits on JPEG encoding.
+    At most max_pending overlays are queued; submit() blocks when the queue is full to bound memory.
+    mode 'none' renders nothing, 'all' every image and 'sample' a deterministic subset of roughly
+    sample_rate of the images (picked by file name, so every model renders the same images).
+    num_threads=0 renders synchronously in the caller.
+    """
+
+    def __init__(self, mode: str = 'all', sample_rate: float = 0.05, num_threads: int = 2, max_pending: int = 32):
+        if mode not in VIZ_MODES:
+            raise ValueError(f"Unknown visualization mode '{mode}', expected one of {VIZ_MODES}")
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.pool = ThreadPoolExecutor(max_workers=num_threads) if num_threads > 0 and mode != 'none' else None
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.errors = 0
+
+    def wants(self, image_filename: str) -> bool:
+        if self.mode == 'all':
+            return True
+        if self.mode == 'none':
+            return False
+        return zlib.crc32(image_filename.encode()) % 10000 < self.sample_rate * 10000
+
+    def _render(self, out_path, inp_for_cam, cam_map, pred_boxes):
+        try:
+            render_cam_overlay(out_path, inp_for_cam, cam_map, pred_boxes)
+        except Exception as e:
+            self.errors += 1
+            print(f"Error writing CAM visualization {out_path}: {e}")
+        finally:
+            if self.pool is not None:
+                self.slots.release()
+
+    def submit(self, out_path: str, inp_for_cam: np.ndarray, cam_map: np.ndarray, pred_boxes) -> None:
+        # Boxes are copied to plain numpy so no model tensors are held by the queue
+        pred_boxes = np.asarray(pred_boxes.cpu() if hasattr(pred_boxes, 'cpu') else pred_boxes, dtype=np.float32).reshape(-1, 4)
+        if self.pool is None:
+            self._render(out_path, inp_for_cam, cam_map, pred_boxes)
+            return
+        self.slots.acquire()
+        self.pool.submit(self._render, out_path, inp_for_cam, cam_map, pred_boxes)
+
+    def close(self) -> None:
+        """Waits until every queued overlay is written."""
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
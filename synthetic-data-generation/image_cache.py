@@ -0,0 +1,171 @@
+import glob
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+import instrumentation
+
+
+class DecodedImageCache:
+    """
+    Decode-once cache for the resized CAM input frames.
+    Frames live in a bounded in-memory LRU and are persisted as .npy files in cache_dir.
+    Disk-backed frames are returned as read-only memory maps, so later runs and all worker processes
+    share the page cache instead of each holding a decoded copy.
+    Disk entries are keyed by path, mtime, file size and target size, so edited images are decoded again;
+    the directory is kept under max_disk_mb by deleting the least recently used files (stale keys age out).
+    Pass cache_dir=None to keep the cache in memory only.
+    """
+
+    # Writes between two size checks of the cache directory
+    PRUNE_EVERY = 256
+
+    def __init__(self, cache_dir: str = '.image_cache', size=(800, 600), max_mb: int = 512, max_disk_mb: int = 4096):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.max_bytes = max_mb * 1024 * 1024
+        self.max_disk_bytes = max_disk_mb * 1024 * 1024
+        self.entries = OrderedDict()  # img_path -> {'uint8': array, 'float32': array or None}
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.hits = self.disk_hits = self.misses = 0
+        self.writes = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.prune()
+
+    def prune(self):
+        """Deletes the least recently used .npy files until the directory fits max_disk_bytes."""
+        files = []
+        for path in glob.glob(os.path.join(self.cache_dir, '*.npy')):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # Removed by another worker
+            files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                # Maps other processes hold on the file stay valid after the unlink
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            removed += 1
+        if removed:
+            instrumentation.count('image_cache_pruned', removed)
+
+    def _map(self, disk_path: str):
+        frame = np.load(disk_path, mmap_mode='r')
+        if frame.shape != (self.size[1], self.size[0], 3) or frame.dtype != np.uint8:
+            raise ValueError(f"Unexpected cached frame {frame.shape} {frame.dtype}")
+        return frame
+
+    def _disk_path(self, img_path: str) -> str:
+        st = os.stat(img_path)
+        key = f"{os.path.abspath(img_path)}|{st.st_mtime_ns}|{st.st_size}|{self.size[0]}x{self.size[1]}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.npy')
+
+    def _load(self, img_path: str):
+        disk_path = None
+        if self.cache_dir:
+            try:
+                disk_path = self._disk_path(img_path)
+            except OSError:
+                return None
+            if os.path.exists(disk_path):
+                try:
+                    with instrumentation.timer('disk_io', op='image_cache_read'):
+                        frame = self._map(disk_path)
+                    # The mtime is the recency prune() goes by (atime is often disabled)
+                    os.utime(disk_path)
+                    with self.lock:
+                        self.disk_hits += 1
+                    instrumentation.count('image_cache_lookups', result='disk')
+                    return frame
+                except (OSError, ValueError):
+                    pass  # Truncated or foreign file, decode again and overwrite it
+
+        with instrumentation.timer('preprocess'):
+            img = cv2.imread(img_path)
+            if img is None:
+                return None
+            frame = cv2.resize(img, self.size)
+        with self.lock:
+            self.misses += 1
+        instrumentation.count('image_cache_lookups', result='decode')
+        if disk_path:
+            tmp_path = f"{disk_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with instrumentation.timer('disk_io', op='image_cache_write'):
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, frame)
+                os.replace(tmp_path, disk_path)  # Atomic, so concurrent workers never read half-written frames
+            with self.lock:
+                self.writes += 1
+                prune = self.writes % self.PRUNE_EVERY == 0
+            if prune:
+                self.prune()
+            try:
+                # Keep the shared mapping rather than this process's private copy
+                return self._map(disk_path)
+            except (OSError, ValueError):
+                pass
+        return frame
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            _, entry = self.entries.popitem(last=False)
+            self.nbytes -= sum(a.nbytes for a in entry.values() if a is not None)
+
+    def _entry(self, img_path: str):
+        with self.lock:
+            entry = self.entries.get(img_path)
+            if entry is not None:
+                self.entries.move_to_end(img_path)
+                self.hits += 1
+                instrumentation.count('image_cache_lookups', result='memory')
+                return entry
+        frame = self._load(img_path)
+        if frame is None:
+            return None
+        with self.lock:
+            entry = self.entries.setdefault(img_path, {'uint8': frame, 'float32': None})
+            if entry['uint8'] is frame:
+                self.nbytes += frame.nbytes
+                self._evict()
+        return entry
+
+    def get(self, img_path: str):
+        """
+        Returns the resized uint8 BGR frame, or None if the image cannot be read.
+        """
+        entry = self._entry(img_path)
+        return None if entry is None else entry['uint8']
+
+    def get_float(self, img_path: str):
+        """
+        Returns the resized frame as float32 in [0, 1] (the `inp_for_cam` of the CAM overlay), or None.
+        """
+        entry = self._entry(img_path)
+        if entry is None:
+            return None
+        if entry['float32'] is None:
+            inp_for_cam = entry['uint8'].astype(np.float32) / 255.0
+            with self.lock:
+                if entry['float32'] is None:
+                    entry['float32'] = inp_for_cam
+                    if img_path in self.entries:
+                        self.nbytes += inp_for_cam.nbytes
+                        self._evict()
+        return entry['float32']
+
+    def stats(self) -> str:
+        return (f"Image cache: {self.hits} memory hits, {self.disk_hits} disk hits, {self.misses} decodes, "
+                f"{len(self.entries)} frames / {self.nbytes / 1024 / 1024:.0f} MB in memory")
@@ -0,0 +1,116 @@
+import hashlib
+import os
+
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = ['.jpg', '.png', '.jpeg']
+
+
+class YoloLabelIndex:
+    """
+    Persistent index of a YOLO dataset folder: original image sizes and all label boxes.
+    Boxes are stored as one float32 (M, 4) array of normalized (xc, yc, w, h) with per-image offsets,
+    so image i owns boxes[offsets[i]:offsets[i + 1]].
+    Every entry remembers the mtime and size of its image and label file and is re-read only when they change.
+    The index is saved as an .npz in index_dir (keyed by the two folder paths).
+    """
+
+    def __init__(self, images_dir: str, labels_dir: str, index_dir: str = '.label_index'):
+        self.images_dir = images_dir
+        self.labels_dir = labels_dir
+        key = hashlib.sha1(f"{os.path.abspath(images_dir)}|{os.path.abspath(labels_dir)}".encode()).hexdigest()
+        self.index_path = os.path.join(index_dir, f"{key}.npz") if index_dir else None
+        self.names = []
+        self.dims = np.zeros((0, 2), dtype=np.int32)       # (w0, h0) per image
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.boxes = np.zeros((0, 4), dtype=np.float32)
+        self.refresh()
+
+    def _load(self) -> dict:
+        if not self.index_path or not os.path.exists(self.index_path):
+            return {}
+        try:
+            with np.load(self.index_path) as data:
+                names, stamps, dims, offsets, boxes = (data['names'], data['stamps'], data['dims'],
+                                                       data['offsets'], data['boxes'])
+        except (OSError, KeyError, ValueError):
+            return {}
+        return {str(name): (tuple(stamps[i]), dims[i], boxes[offsets[i]:offsets[i + 1]])
+                for i, name in enumerate(names)}
+
+    @staticmethod
+    def _read_labels(label_path: str) -> np.ndarray:
+        rows = []
+        with open(label_path, 'r') as f:
+            for line in f:
+                parts = line.strip().split()
+                if len(parts) != 5:
+                    continue
+                rows.append([float(p) for p in parts[1:]])
+        return np.asarray(rows, dtype=np.float32).reshape(-1, 4)
+
+    def refresh(self):
+        """
+        Brings the index up to date with the folders, re-reading only new or changed files.
+        """
+        cached = self._load()
+        label_stats = {}
+        if os.path.isdir(self.labels_dir):
+            label_stats = {e.name: e.stat() for e in os.scandir(self.labels_dir) if e.name.endswith('.txt')}
+
+        names, stamps, dims, box_chunks = [], [], [], []
+        changed = len(cached) == 0
+        # os.scandir keeps the os.listdir order the per-image CSV rows have always followed
+        for entry in os.scandir(self.images_dir):
+            base, ext = os.path.splitext(entry.name)
+            if ext.lower() not in IMAGE_EXTENSIONS:
+                continue
+            st = entry.stat()
+            lst = label_stats.get(base + '.txt')
+            stamp = (st.st_mtime_ns, st.st_size,
+                     lst.st_mtime_ns if lst else -1, lst.st_size if lst else -1)
+            if entry.name in cached and cached[entry.name][0] == stamp:
+                _, wh, boxes = cached[entry.name]
+            else:
+                changed = True
+                try:
+                    # Only the header is parsed to get the size, the pixels are never decoded
+                    with Image.open(entry.path) as img_pil:
+                        wh = np.array(img_pil.size, dtype=np.int32)
+                except OSError as e:
+                    print(f"Warning: Could not read image size of {entry.path}: {e}. Skipping.")
+                    continue
+                boxes = self._read_labels(os.path.join(self.labels_dir, base + '.txt')) if lst else np.zeros((0, 4), np.float32)
+            names.append(entry.name)
+            stamps.append(stamp)
+            dims.append(wh)
+            box_chunks.append(boxes)
+
+        changed = changed or len(names) != len(cached)
+        self.names = names
+        self.dims = np.asarray(dims, dtype=np.int32).reshape(-1, 2)
+        self.offsets = np.concatenate(([0], np.cumsum([len(b) for b in box_chunks]))).astype(np.int64)
+        self.boxes = np.concatenate(box_chunks).astype(np.float32) if box_chunks else np.zeros((0, 4), np.float32)
+
+        if changed and self.index_path:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            tmp_path = f"{self.index_path}.{os.getpid()}.tmp.npz"
+            np.savez(tmp_path, names=np.asarray(names, dtype=str), stamps=np.asarray(stamps, dtype=np.int64).reshape(-1, 4),
+                     dims=self.dims, offsets=self.offsets, boxes=self.boxes)
+            os.replace(tmp_path, self.index_path)
+
+    def scaled_boxes(self, target_size=(800, 600)) -> dict:
+        """
+        Pixel (x1, y1, x2, y2) boxes of every image, rescaled to target_size in one vectorized pass.
+        Returns {image_filename: [[x1, y1, x2, y2], ...]} in folder order, like load_yolo_labels.
+        """
+        counts = np.diff(self.offsets)
+        # Per-box original size, repeated from the per-image dims
+        wh = np.repeat(self.dims.astype(np.float64), counts, axis=0)
+        b = self.boxes.astype(np.float64)
+        xc, yc = b[:, 0] * wh[:, 0], b[:, 1] * wh[:, 1]
+        w, h = b[:, 2] * wh[:, 0], b[:, 3] * wh[:, 1]
+        sx, sy = target_size[0] / wh[:, 0], target_size[1] / wh[:, 1]
+        pixel = np.stack([(xc - w / 2) * sx, (yc - h / 2) * sy, (xc + w / 2) * sx, (yc + h / 2) * sy], axis=1)
+        return {name: pixel[self.offsets[i]:self.offsets[i + 1]].tolist() for i, name in enumerate(self.names)}
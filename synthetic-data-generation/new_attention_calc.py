@@ -8,6 +8,8 @@ from PIL import Image
 import os
 import warnings
 import argparse
+from cam_capture import MultiLayerEigenCAM, iter_image_batches
+from label_index import YoloLabelIndex
 
 warnings.filterwarnings("ignore")
 
@@ -35,50 +37,38 @@ def compute_center_distance(cam: np.ndarray, boxes: list) -> float:
     return float(np.mean(dists))
 
 def load_yolo_labels(images_dir: str, labels_dir: str, size=(800,600)) -> dict:
-    annots = {}
-    for fn in os.listdir(images_dir):
-        base, ext = os.path.splitext(fn)
-        if ext.lower() not in ['.jpg', '.png', '.jpeg']:
-            continue
-        img = cv2.imread(os.path.join(images_dir, fn))
-        h0, w0 = img.shape[:2]
-        sx, sy = size[0] / w0, size[1] / h0
-        boxes = []
-        lp = os.path.join(labels_dir, base + '.txt')
-        if os.path.exists(lp):
-            for line in open(lp):
-                parts = line.split()
-                if len(parts) != 5:
-                    continue
-                _, xc, yc, w, h = map(float, parts)
-                xc, yc = xc * w0, yc * h0
-                w, h = w * w0, h * h0
-                x1, y1 = xc - w/2, yc - h/2
-                x2, y2 = xc + w/2, yc + h/2
-                boxes.append([x1 * sx, y1 * sy, x2 * sx, y2 * sy])
-        annots[fn] = boxes
-    return annots
+    return YoloLabelIndex(images_dir, labels_dir).scaled_boxes(size)
 
-def process_single_image(model, img_path: str, layer, boxes, exp: str, layer_idx: int, metrics):
-    img = cv2.imread(img_path)
-    resized = cv2.resize(img, (800, 600))
-    inp = resized.astype(np.float32) / 255
-    cam_extractor = EigenCAM(model, [layer], task='od')
-    cam_map = cam_extractor(resized)[0]
+def record_cam(img_path: str, resized, cam_map, pred_boxes, boxes, exp: str, layer_idx: int, metrics):
+    """Metrics of one CAM map and its overlay with the predicted boxes, shared by the per-image and batched paths."""
     cov = compute_box_coverage(cam_map, boxes)
     dist = compute_center_distance(cam_map, boxes)
     metrics[exp].append({'layer': layer_idx, 'coverage': cov, 'dist': dist})
 
-    cam_img = show_cam_on_image(inp, cam_map, use_rgb=True)
-    for x1, y1, x2, y2 in model(resized)[0].boxes.xyxy:
+    cam_img = show_cam_on_image(resized.astype(np.float32) / 255, cam_map, use_rgb=True)
+    for x1, y1, x2, y2 in pred_boxes:
         cv2.rectangle(cam_img, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
     out_dir = f"cam_{exp}"
     os.makedirs(out_dir, exist_ok=True)
     out_path = os.path.join(out_dir, f"{os.path.basename(img_path)}_l{layer_idx}.jpg")
     cv2.imwrite(out_path, cam_img)
 
+def process_single_image(model, img_path: str, layer, boxes, exp: str, layer_idx: int, metrics):
+    img = cv2.imread(img_path)
+    resized = cv2.resize(img, (800, 600))
+    cam_extractor = EigenCAM(model, [layer], task='od')
+    cam_map = cam_extractor(resized)[0]
+    record_cam(img_path, resized, cam_map, model(resized)[0].boxes.xyxy, boxes, exp, layer_idx, metrics)
+
+def process_batch(cam_capture, img_paths: list, resized_imgs: list, annotations: dict, exp: str, metrics):
+    cams, results = cam_capture.batch(resized_imgs)
+    for img_path, resized, img_cams, res in zip(img_paths, resized_imgs, cams, results):
+        boxes = annotations[os.path.basename(img_path)]
+        for layer_idx, cam_map in img_cams.items():
+            record_cam(img_path, resized, cam_map, res.boxes.xyxy, boxes, exp, layer_idx, metrics)
+
 
-def doMultiScale(models, imgs, lbls, layers, dev):
+def doMultiScale(models, imgs, lbls, layers, dev, batch_size=1):
     # Parse models: allow 'path:name' or 'path'
     mlist = []
     for m in models:
@@ -94,6 +84,13 @@ def doMultiScale(models, imgs, lbls, layers, dev):
 
     for path, name in mlist:
         model = YOLO(path).to(dev)
+        if batch_size > 1:
+            cam_capture = MultiLayerEigenCAM(model, [(idx, model.model.model[idx]) for idx in layers])
+            img_paths = [os.path.join(imgs, fn) for fn in annotations]
+            for paths, batch in iter_image_batches(img_paths, batch_size):
+                process_batch(cam_capture, paths, batch, annotations, name, metrics)
+            cam_capture.release()
+            continue
         for fn, boxes in annotations.items():
             img_path = os.path.join(imgs, fn)
             for idx in layers:
@@ -142,5 +139,6 @@ if __name__ == '__main__':
     parser.add_argument('--labels', required=True)
     parser.add_argument('--layers', nargs='+', type=int, default=[5,8,16,19,22])
     parser.add_argument('--device', default='cpu')
+    parser.add_argument('--batch-size', type=int, default=1)
     args = parser.parse_args()
-    doMultiScale(args.models, args.images, args.labels, args.layers, args.device)
+    doMultiScale(args.models, args.images, args.labels, args.layers, args.device, args.batch_size)
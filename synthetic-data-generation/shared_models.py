@@ -0,0 +1,103 @@
+import multiprocessing
+import os
+from contextlib import contextmanager
+
+import torch
+from ultralytics import YOLO
+
+import instrumentation
+
+# Models loaded by the parent before the pool forks, inherited by every worker: model_path -> YOLO or None
+_preloaded = {}
+
+
+@contextmanager
+def _single_thread():
+    # Fusing runs a few small matmuls; keeping them single-threaded means no OpenMP pool is alive when the parent forks
+    num_threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+    try:
+        yield
+    finally:
+        torch.set_num_threads(num_threads)
+
+
+def load_inference_model(model_path: str, device: str = 'cpu') -> YOLO:
+    """
+    Loads a checkpoint ready for inference: Conv+BN fused, eval mode, no gradients.
+    The predictor sees an already fused model and uses it as is instead of fusing (and copying) it again.
+    """
+    model = YOLO(model_path).to(device)
+    model.fuse()
+    model.eval()
+    for p in model.model.parameters():
+        p.requires_grad_(False)
+    return model
+
+
+def fork_available() -> bool:
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def preload_shared_models(model_paths: list, device: str = 'cpu') -> dict:
+    """
+    Loads and fuses every checkpoint once in the parent process, before a fork-based pool starts.
+    CPU weights are moved into shared memory, so the forked workers map the same pages instead of
+    each holding a private copy (plain copy-on-write would already share them until a page is written,
+    shared memory keeps that true regardless of what touches the tensors). Returns {model_path: YOLO or None}.
+    """
+    total_bytes = 0
+    with _single_thread():
+        for model_path in model_paths:
+            if model_path in _preloaded:
+                continue
+            try:
+                model = load_inference_model(model_path, device)
+                if device == 'cpu':
+                    model.model.share_memory()
+                total_bytes += sum(t.numel() * t.element_size() for t in model.model.state_dict().values())
+                _preloaded[model_path] = model
+            except Exception as e:
+                print(f"Error loading model {model_path}: {e}. Skipping this model.")
+                _preloaded[model_path] = None
+    loaded = sum(m is not None for m in _preloaded.values())
+    print(f"Preloaded {loaded} fused models ({total_bytes / 1024 / 1024:.0f} MB of weights) for sharing with the workers.")
+    return _preloaded
+
+
+def get_model(model_path: str, device: str = 'cpu'):
+    """
+    The preloaded (shared) model if the parent loaded it before forking, otherwise a private copy.
+    Returns None for a model that failed to preload.
+    """
+    if model_path in _preloaded:
+        return _preloaded[model_path]
+    return load_inference_model(model_path, device)
+
+
+def process_memory(pid='self') -> dict:
+    """
+    Memory of a process in MB. On Linux from /proc/<pid>/smaps_rollup: rss, pss (shared pages divided among
+    the processes mapping them), shared and private. Elsewhere only the peak RSS of this process.
+    """
+    try:
+        fields = {}
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1]) / 1024
+        return {'rss': fields.get('Rss', 0.0), 'pss': fields.get('Pss', 0.0),
+                'shared': fields.get('Shared_Clean', 0.0) + fields.get('Shared_Dirty', 0.0),
+                'private': fields.get('Private_Clean', 0.0) + fields.get('Private_Dirty', 0.0)}
+    except (OSError, ValueError):
+        return {'peak_rss': (instrumentation.peak_rss_bytes() or 0) / 1024 / 1024}
+
+
+def format_memory(mem: dict) -> str:
+    return ', '.join(f"{k.upper() if k in ('rss', 'pss') else k} {v:.0f} MB" for k, v in mem.items())
+
+
+def print_worker_memory():
+    """Memory line of the calling pool worker, printed when the worker exits."""
+    print(f"Worker {os.getpid()} memory: {format_memory(process_memory())}")
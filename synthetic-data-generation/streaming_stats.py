@@ -0,0 +1,144 @@
+import math
+from statistics import NormalDist
+
+# Two-sided 95% Student t critical values for 1..7 degrees of freedom, where the series below is too coarse
+_T95_SMALL_DF = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365}
+
+
+def t_critical_95(df: int) -> float:
+    """
+    Two-sided 95% Student t critical value, without scipy.
+    Uses the Cornish-Fisher expansion around the normal quantile (error < 1e-3 from 8 degrees of freedom on).
+    """
+    if df <= 0:
+        return float('nan')
+    if df in _T95_SMALL_DF:
+        return _T95_SMALL_DF[df]
+    z = NormalDist().inv_cdf(0.975)
+    return (z + (z ** 3 + z) / (4 * df) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3))
+
+
+class Welford:
+    """
+    Streaming mean and variance (Welford), mergeable with Chan's parallel update.
+    """
+
+    __slots__ = ('n', 'mean', 'm2')
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x: float):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def merge(self, other: 'Welford'):
+        if other.n == 0:
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.n = n
+
+    @property
+    def std(self) -> float:
+        """Sample standard deviation (n - 1), nan below two samples."""
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else float('nan')
+
+    def ci95(self) -> tuple:
+        """95% confidence interval of the mean (Student t), nan below two samples."""
+        if self.n < 2:
+            return float('nan'), float('nan')
+        half = t_critical_95(self.n - 1) * self.std / math.sqrt(self.n)
+        return self.mean - half, self.mean + half
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with relative accuracy (DDSketch): values are counted in logarithmic buckets
+    of width gamma = (1 + alpha) / (1 - alpha), so every quantile is returned within a relative error of alpha.
+    Memory depends on the value range (about 1200 buckets from 1e-6 to 1e4 at alpha=0.01), not on the count.
+    Values with a magnitude below min_value are counted as zero.
+    """
+
+    __slots__ = ('alpha', 'gamma', 'log_gamma', 'min_value', 'positive', 'negative', 'zeros', 'n')
+
+    def __init__(self, alpha: float = 0.01, min_value: float = 1e-9):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.min_value = min_value
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.n = 0
+
+    def add(self, x: float):
+        self.n += 1
+        if abs(x) < self.min_value:
+            self.zeros += 1
+            return
+        store = self.positive if x > 0 else self.negative
+        key = math.ceil(math.log(abs(x)) / self.log_gamma)
+        store[key] = store.get(key, 0) + 1
+
+    def merge(self, other: 'QuantileSketch'):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge quantile sketches with different accuracy")
+        for mine, theirs in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, c in theirs.items():
+                mine[key] = mine.get(key, 0) + c
+        self.zeros += other.zeros
+        self.n += other.n
+
+    def _value(self, key: int) -> float:
+        # Midpoint of the bucket (gamma^(key-1), gamma^key] in the relative sense
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q: float) -> float:
+        if self.n == 0:
+            return float('nan')
+        rank = q * (self.n - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.positive)) if self.positive else 0.0
+
+
+class StreamingStats:
+    """Welford moments plus a quantile sketch for one metric of one group."""
+
+    __slots__ = ('moments', 'sketch')
+
+    def __init__(self):
+        self.moments = Welford()
+        self.sketch = QuantileSketch()
+
+    def add(self, x: float):
+        self.moments.add(x)
+        self.sketch.add(x)
+
+    def merge(self, other: 'StreamingStats'):
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+
+    def summary(self, prefix: str) -> dict:
+        low, high = self.moments.ci95()
+        return {prefix: self.moments.mean, f"{prefix}_std": self.moments.std,
+                f"{prefix}_p50": self.sketch.quantile(0.5), f"{prefix}_p90": self.sketch.quantile(0.9),
+                f"{prefix}_ci95_low": low, f"{prefix}_ci95_high": high}
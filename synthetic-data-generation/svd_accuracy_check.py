@@ -0,0 +1,149 @@
+import argparse
+import csv
+import os
+import time
+import warnings
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+from ultralytics import YOLO
+
+from attention_metrics import compute_attention_metrics
+from cam_capture import SVD_METHODS, MultiLayerEigenCAM, batched_2d_projection, eigen_cam_from_activations, projection_for, resolve_target_layers
+from image_cache import DecodedImageCache
+from label_index import YoloLabelIndex
+
+warnings.filterwarnings("ignore")
+
+FIELDNAMES = ['experiment', 'image_filename', 'layer', 'method', 'exact_s', 'fast_s', 'sign_flip', 'map_max_abs_diff',
+              'map_corr', 'coverage_exact', 'coverage_fast', 'coverage_aligned', 'center_dist_exact', 'center_dist_fast',
+              'center_dist_aligned']
+
+
+def workload_from_detail(detail_path: str) -> dict:
+    """
+    {experiment: [image_filename, ...]} of an attention_metrics_detail.csv, in the order the sweep wrote them.
+    """
+    workload = OrderedDict()
+    with open(detail_path, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            workload.setdefault(row['experiment'], OrderedDict())[row['image_filename']] = True
+    return {exp_name: list(images) for exp_name, images in workload.items()}
+
+
+def check_image(activations: np.ndarray, target_size: tuple, boxes: list, projections: dict) -> dict:
+    """
+    Compares the fast projections of one layer's activations against the exact SVD (yolo_cam's sign).
+    'aligned' gives the fast component the exact result's sign, so it only measures the truncation error;
+    'fast' is what a sweep with the fast method records (its own sign convention, see orient_projection).
+    Returns {method: row}.
+    """
+    start = time.perf_counter()
+    exact_proj = batched_2d_projection(activations)
+    exact_s = time.perf_counter() - start
+    exact_cam = eigen_cam_from_activations(activations, target_size, lambda _: exact_proj)[0]
+
+    rows = {}
+    for method, projection in projections.items():
+        start = time.perf_counter()
+        fast_proj = projection(activations)
+        fast_s = time.perf_counter() - start
+        flip = float(np.sum(fast_proj * exact_proj)) < 0
+        aligned_proj = -fast_proj if flip else fast_proj
+        fast_cam = eigen_cam_from_activations(activations, target_size, lambda _: fast_proj)[0]
+        aligned_cam = eigen_cam_from_activations(activations, target_size, lambda _: aligned_proj)[0]
+        m = compute_attention_metrics({'exact': exact_cam, 'fast': fast_cam, 'aligned': aligned_cam}, boxes)
+        corr = np.corrcoef(exact_cam.ravel(), aligned_cam.ravel())[0, 1] if exact_cam.std() > 0 and aligned_cam.std() > 0 else 1.0
+        rows[method] = {
+            'method': method, 'exact_s': exact_s, 'fast_s': fast_s, 'sign_flip': int(flip),
+            'map_max_abs_diff': float(np.abs(exact_cam - aligned_cam).max()), 'map_corr': float(corr),
+            'coverage_exact': m['exact']['coverage'], 'coverage_fast': m['fast']['coverage'], 'coverage_aligned': m['aligned']['coverage'],
+            'center_dist_exact': m['exact']['dist'], 'center_dist_fast': m['fast']['dist'], 'center_dist_aligned': m['aligned']['dist'],
+        }
+    return rows
+
+
+def summarize(rows: list):
+    groups = defaultdict(list)
+    for row in rows:
+        groups[(row['method'], row['layer'])].append(row)
+    print("\n--- SVD Accuracy Summary (fast vs exact) ---")
+    for (method, layer), group in sorted(groups.items()):
+        exact_s = sum(r['exact_s'] for r in group)
+        fast_s = sum(r['fast_s'] for r in group)
+        d_cov = np.array([abs(r['coverage_aligned'] - r['coverage_exact']) for r in group])
+        d_dist = np.array([abs(r['center_dist_aligned'] - r['center_dist_exact']) for r in group])
+        d_cov_run = np.array([abs(r['coverage_fast'] - r['coverage_exact']) for r in group])
+        print(f"  {method:10s} Layer: {layer} | Speedup: {exact_s / (fast_s + 1e-12):.1f}x "
+              f"({exact_s / len(group) * 1000:.1f} -> {fast_s / len(group) * 1000:.1f} ms) | "
+              f"|dCoverage| mean {d_cov.mean():.4f} max {d_cov.max():.4f} | "
+              f"|dDistance| mean {d_dist.mean():.4f} max {d_dist.max():.4f} | "
+              f"Min corr: {min(r['map_corr'] for r in group):.4f} | "
+              f"Sign flips: {sum(r['sign_flip'] for r in group)}/{len(group)} "
+              f"(|dCoverage| as run: mean {d_cov_run.mean():.4f}) | Samples: {len(group)}")
+
+
+def run_check(model_configs: list, images_dir: str, labels_dir: str, layers_to_analyze: list, device: str,
+              detail_path: str, out_path: str, methods: list, iters: int, tol: float, limit: int):
+    annotations = YoloLabelIndex(images_dir, labels_dir).scaled_boxes((800, 600))
+    workload = workload_from_detail(detail_path) if detail_path and os.path.exists(detail_path) else {}
+    image_cache = DecodedImageCache(None)
+    projections = {method: projection_for(method, iters, tol) for method in methods}
+
+    rows = []
+    with open(out_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for config in model_configs:
+            exp_name = config['name']
+            # Check the images the sweep actually measured for this model, or the whole folder without a detail CSV
+            images = [fn for fn in workload.get(exp_name, annotations) if fn in annotations][:limit]
+            print(f"\n--- Checking Model: {exp_name} ({config['path']}) on {len(images)} images ---")
+            try:
+                model = YOLO(config['path']).to(device)
+                model.eval()
+            except Exception as e:
+                print(f"Error loading model {config['path']}: {e}. Skipping this model.")
+                continue
+            cam_capture = MultiLayerEigenCAM(model, resolve_target_layers(model, layers_to_analyze, exp_name))
+            for fn in images:
+                img = image_cache.get(os.path.join(images_dir, fn))
+                if img is None:
+                    print(f"Warning: Could not read image {fn}. Skipping.")
+                    continue
+                cam_capture.forward(img)
+                for layer_id, activations in cam_capture.activations.items():
+                    for row in check_image(activations.numpy(), (img.shape[1], img.shape[0]), annotations[fn], projections).values():
+                        row.update(experiment=exp_name, image_filename=fn, layer=layer_id)
+                        writer.writerow(row)
+                        rows.append(row)
+                f.flush()
+            cam_capture.release()
+    print(f"\nSaved per-image results to {out_path}")
+    if rows:
+        summarize(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check the fast EigenCAM SVD methods against the exact SVD on the attention sweep workload.")
+    parser.add_argument('--models', nargs='+', required=True,
+                        help="Model paths, optionally as path:name with the experiment names used in the detail CSV.")
+    parser.add_argument('--images', required=True, help="Directory with the images of the sweep.")
+    parser.add_argument('--labels', required=True, help="Directory with the YOLO format label files.")
+    parser.add_argument('--layers', nargs='+', type=int, default=[10, 16, 19, 22], help="Layer indices to check.")
+    parser.add_argument('--device', default='cpu', help="Device to run inference on (e.g., 'cpu', 'cuda:0').")
+    parser.add_argument('--detail', default='attention_metrics_detail.csv',
+                        help="Detail CSV of a previous sweep; only its (experiment, image) pairs are checked.")
+    parser.add_argument('--limit', type=int, default=50, help="Maximum number of images per model.")
+    parser.add_argument('--methods', nargs='+', choices=[m for m in SVD_METHODS if m != 'exact'], default=['power', 'randomized'])
+    parser.add_argument('--svd-iters', type=int, default=None, help="Iterations of the fast methods (method default if omitted).")
+    parser.add_argument('--svd-tol', type=float, default=1e-4, help="Convergence tolerance of 'power'.")
+    parser.add_argument('--out', default='svd_accuracy_detail.csv', help="Output CSV with one row per image, layer and method.")
+    args = parser.parse_args()
+
+    model_configs = []
+    for m in args.models:
+        path, name = m.split(':', 1) if ':' in m else (m, os.path.splitext(os.path.basename(m))[0])
+        model_configs.append({'path': path, 'name': name})
+    run_check(model_configs, args.images, args.labels, args.layers, args.device, args.detail, args.out,
+              args.methods, args.svd_iters, args.svd_tol, args.limit)
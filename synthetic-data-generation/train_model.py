@@ -2,8 +2,10 @@ from ultralytics import YOLO
 import subprocess
 import os
 
+from cpu_precision import PRECISION_MODES, compare_precisions, print_comparison
 
-def run(dataset_dir, num_epochs, results_dir):
+
+def run(dataset_dir, num_epochs, results_dir, val_precisions=()):
 
     model = YOLO("yolo12m.pt")
     train_res = model.train(data=f"{dataset_dir}/data.yaml",
@@ -31,6 +33,15 @@ def run(dataset_dir, num_epochs, results_dir):
         f.write(f"MAP50: {mAP50}\n")
         f.write(f"MAP50-95: {mAP50_95}\n")
 
+    # Optional CPU precision check of the trained model on the test split
+    if val_precisions:
+        rows = compare_precisions(f"{results_dir}/best.pt", f"{dataset_dir}/data.yaml", val_precisions, split="test")
+        print_comparison(rows)
+        with open(f"{results_dir}/results.txt", "a") as f:
+            for row in rows[1:]:
+                f.write(f"{row['precision']} MAP50: {row['map50']} ({row['map50_delta']:+.4f}), "
+                        f"MAP50-95: {row['map50_95']} ({row['map50_95_delta']:+.4f}), speedup: {row['speedup']:.2f}x\n")
+
     print(
         f"Now you should copy the {results_dir}/best.pt to Object_Detection_Yolo_with_FastAPI/model.pt")
 
@@ -46,6 +57,9 @@ if __name__ == '__main__':
                         help='Number of epochs to train the model')
     parser.add_argument('--results_dir', type=str,
                         help='Path to the results directory')
+    parser.add_argument('--val_precisions', type=str, nargs='*', default=[], choices=PRECISION_MODES[1:],
+                        help='Also validate the best model on CPU in these precisions and report the mAP delta and speedup '
+                             '(int8 needs the openvino extra: uv sync --extra openvino)')
     args = parser.parse_args()
 
-    run(args.dataset_dir, args.num_epochs, args.results_dir)
+    run(args.dataset_dir, args.num_epochs, args.results_dir, args.val_precisions)
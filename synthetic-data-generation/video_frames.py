@@ -0,0 +1,170 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import cv2
+
+import instrumentation
+
+
+class FrameRingBuffer:
+    """
+    The last `capacity` decoded (and resized) frames of a video by frame index.
+    Reading forward decodes sequentially; a frame older than the buffer is reached by reopening the capture and
+    seeking to it, so stepping back works at any distance while memory stays at capacity frames.
+    Thread-safe, the capture is only touched under the lock.
+    """
+
+    def __init__(self, video_path: str, capacity: int = 64, size=(800, 600)):
+        self.video_path = video_path
+        self.capacity = max(1, capacity)
+        self.size = size
+        self.frames = OrderedDict()  # frame index -> frame, in decode order
+        self.lock = threading.Lock()
+        self.cap = cv2.VideoCapture(video_path)
+        self.next_index = 0  # index of the frame the next cap.read() returns
+        self.end = None  # number of frames, once the end was reached
+
+    def _seek(self, index: int):
+        # Reopening resets decoder state that some backends keep after reaching the end of the file
+        self.cap.release()
+        self.cap = cv2.VideoCapture(self.video_path)
+        if index:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        self.next_index = index
+        instrumentation.count('frame_seeks')
+
+    def get(self, index: int):
+        """The frame at index, or None past the end of the video."""
+        with self.lock:
+            if index in self.frames:
+                return self.frames[index]
+            if self.end is not None and index >= self.end:
+                return None
+            if index < self.next_index:
+                # Behind the decoder: start a few frames earlier, so stepping further back hits the buffer
+                self._seek(max(0, index - self.capacity // 4))
+            elif index > self.next_index + self.capacity:
+                # So far ahead that decoding up to it would only fill the buffer with skipped frames
+                self._seek(index)
+            while self.next_index <= index:
+                with instrumentation.timer('preprocess', op='video_decode'):
+                    ret, frame = self.cap.read()
+                    if not ret:
+                        self.end = self.next_index
+                        return None
+                    frame = cv2.resize(frame, self.size)
+                instrumentation.count('frames_decoded')
+                self.frames[self.next_index] = frame
+                self.next_index += 1
+                while len(self.frames) > self.capacity:
+                    self.frames.popitem(last=False)
+            return self.frames[index]
+
+    def release(self):
+        with self.lock:
+            self.cap.release()
+            self.frames.clear()
+
+
+class FramePrefetcher:
+    """
+    Frames and their detections of every model, computed ahead of the viewer: after seek(index) a background
+    thread decodes and runs the models on the next `ahead` frames, so stepping forward finds them ready.
+    Results are kept for the last `capacity` frames, older ones are computed again when revisited.
+    The models are only called under one lock, so the viewer and the prefetch thread never share a predictor.
+    """
+
+    def __init__(self, frames: FrameRingBuffer, models, model_names, ahead: int = 4):
+        self.frames = frames
+        self.models = models
+        self.model_names = model_names
+        self.ahead = ahead
+        self.futures = OrderedDict()  # frame index -> Future of (frame, [results per model]) or None at the end
+        self.lock = threading.Lock()
+        self.infer_lock = threading.Lock()
+        self.moved = threading.Condition(self.lock)
+        self.position = 0
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, name="frame-prefetch", daemon=True)
+
+    def start(self):
+        if self.ahead > 0:
+            self.thread.start()
+        return self
+
+    def _compute(self, index: int, future: Future):
+        try:
+            frame = self.frames.get(index)
+            if frame is None:
+                future.set_result(None)
+                return
+            all_results = []
+            with self.infer_lock:
+                for model, model_name in zip(self.models, self.model_names):
+                    with instrumentation.timer('inference', model=model_name):
+                        all_results.append(model(frame, verbose=False))
+            future.set_result((frame, all_results))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _claim(self, index: int):
+        """The future of index and whether the caller has to compute it."""
+        with self.lock:
+            future = self.futures.get(index)
+            # A failed frame is computed again instead of replaying its error
+            if future is not None and not (future.done() and future.exception() is not None):
+                return future, False
+            self.futures.pop(index, None)
+            future = self.futures[index] = Future()
+            # Only finished entries are evicted, a pending one is still awaited by some thread
+            while len(self.futures) > self.frames.capacity:
+                oldest = next(iter(self.futures))
+                if not self.futures[oldest].done():
+                    break
+                del self.futures[oldest]
+            return future, True
+
+    def get(self, index: int):
+        """(frame, [results per model]) at index, or None past the end. Waits if the prefetch thread is on it."""
+        future, owner = self._claim(index)
+        if owner:
+            self._compute(index, future)
+        else:
+            instrumentation.count('prefetch_hits')
+        return future.result()
+
+    def seek(self, index: int):
+        with self.lock:
+            self.position = index
+            self.moved.notify()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                self.moved.wait_for(lambda: self.stopped or any(
+                    i not in self.futures for i in range(self.position + 1, self.position + 1 + self.ahead)))
+                if self.stopped:
+                    return
+                position = self.position
+            for index in range(position + 1, position + 1 + self.ahead):
+                if self.stopped or self.position != position:
+                    break
+                future, owner = self._claim(index)
+                if owner:
+                    self._compute(index, future)
+                if future.exception() is not None or future.result() is None:
+                    break
+            else:
+                continue
+            with self.lock:
+                # End of the video: wait for the viewer to move before trying again
+                if self.position == position and not self.stopped:
+                    self.moved.wait()
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.moved.notify()
+        if self.thread.is_alive():
+            self.thread.join(timeout=5)
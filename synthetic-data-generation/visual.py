@@ -1,18 +1,34 @@
-from ultralytics import YOLO
 import cv2
 import os
 import argparse
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import instrumentation
+from cpu_precision import PRECISION_MODES, load_cpu_precision_model
+from video_frames import FramePrefetcher, FrameRingBuffer
 
 RESIZE_WIDTH = 1920
 RESIZE_HEIGHT = 1080
 
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+# Leading bytes of the formats above (WebP is RIFF....WEBP, checked separately)
+IMAGE_SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'BM', b'II*\x00', b'MM\x00*')
+# Images whose detections are kept for going back and for saving without running the models again
+RESULTS_CACHE_IMAGES = 16
+
 
 def visualize_and_display(image, results, window_name, save=False, savename=""):
-    image = cv2.resize(image, (RESIZE_WIDTH, RESIZE_HEIGHT)
-                       )  # Resize image to 800x600
-    annotated_img = results[0].plot()
-    # Resize annotated image to 800x600
-    annotated_img = cv2.resize(annotated_img, (RESIZE_WIDTH, RESIZE_HEIGHT))
+    with instrumentation.timer('render'):
+        image = cv2.resize(image, (RESIZE_WIDTH, RESIZE_HEIGHT)
+                           )  # Resize image to 800x600
+        annotated_img = results[0].plot()
+        # Resize annotated image to 800x600
+        annotated_img = cv2.resize(annotated_img, (RESIZE_WIDTH, RESIZE_HEIGHT))
 
     num_objects = len(results[0].boxes) if hasattr(results[0], 'boxes') else 0
 
@@ -33,70 +49,249 @@ def visualize_and_display(image, results, window_name, save=False, savename=""):
         print(f"Saving annotated image to {savename}")
         # make folder if not exists
         os.makedirs(os.path.dirname(savename), exist_ok=True)
-        cv2.imwrite(savename, annotated_img)
+        with instrumentation.timer('disk_io', op='image_write'):
+            cv2.imwrite(savename, annotated_img)
     else:
         cv2.imshow(window_name, annotated_img)
 
 
-def save_images(models, model_names, img, img_path):
-    for model, model_name in zip(models, model_names):
+def save_images(models, model_names, img, img_path, all_results=None):
+    """Saves the annotated image of every model; all_results (one per model) skips running the models again."""
+    for i, (model, model_name) in enumerate(zip(models, model_names)):
         # create a folder to save the output images
         os.makedirs("visualize_output", exist_ok=True)
         save_path = f"visualize_output/{model_name}_{os.path.basename(img_path)}"
-        results = model(img)
+        if all_results is not None:
+            results = all_results[i]
+        else:
+            with instrumentation.timer('inference', model=model_name):
+                results = model(img)
         visualize_and_display(
             img, results, f'YOLOv11 Detection - {model_name}', save=True, savename=save_path)
     pass
 
 
-def process_video(video_path, models, model_names):
-    cap = cv2.VideoCapture(video_path)
-    frames = []
+def process_video(video_path, models, model_names, buffer_frames=64, prefetch=4):
+    # Frames resized to 800x600; only the last buffer_frames are kept, older ones are decoded again on demand
+    frames = FrameRingBuffer(video_path, buffer_frames, (800, 600))
+    # Decodes and runs the models on the next frames while the current one is on screen
+    prefetcher = FramePrefetcher(frames, models, model_names, prefetch).start()
     frame_idx = 0
 
-    while cap.isOpened():
-        if frame_idx < len(frames):
-            frame = frames[frame_idx]
-        else:
-            ret, frame = cap.read()
-            if not ret:
+    try:
+        while True:
+            prefetcher.seek(frame_idx)
+            item = prefetcher.get(frame_idx)
+            if item is None:
                 break
-            frame = cv2.resize(frame, (800, 600))  # Resize frame to 800x600
-            frames.append(frame)
+            frame, all_results = item
 
-        for model, model_name in zip(models, model_names):
-            results = model(frame)
-            visualize_and_display(
-                frame, results, f'YOLOv11 Detection - {model_name}')
+            for results, model_name in zip(all_results, model_names):
+                visualize_and_display(
+                    frame, results, f'YOLOv11 Detection - {model_name}')
 
-        key = cv2.waitKey(0) & 0xFF
-        if key == ord('q'):
+            key = cv2.waitKey(0) & 0xFF
+            if key == ord('q'):
+                break
+            elif key == 2:  # Left arrow key
+                frame_idx = max(0, frame_idx - 1)
+            elif key == ord('s'):
+                save_images(models, model_names, frame, video_path, all_results)
+                frame_idx += 1
+            else:
+                frame_idx += 1
+    finally:
+        # Also on an inference error or Ctrl+C, so the prefetch thread and the capture do not outlive the viewer
+        prefetcher.stop()
+        frames.release()
+        cv2.destroyAllWindows()
+
+
+EXPORT_SIZE = (800, 600)
+
+
+def export_video(video_path, models, model_names, export_path, layout='side-by-side', queue_size=8):
+    """
+    Writes the annotated video of every model without a window: one side-by-side video at export_path,
+    or one video per model (<export stem>_<model name>.<ext>) with layout='per-model'.
+    Decoding, each model's inference and encoding run on their own threads, connected by bounded queues,
+    so the models work on consecutive frames in parallel and memory stays at a few frames per queue.
+    Returns False if the export failed.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"Could not open video {video_path}")
+        return False
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    model_inputs = [queue.Queue(maxsize=queue_size) for _ in models]
+    model_outputs = [queue.Queue(maxsize=queue_size) for _ in models]
+    error = []
+    # Set when a stage fails; every put/get below gives up on it, so no stage stays blocked on a dead neighbour
+    stop = threading.Event()
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def get(q):
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if stop.is_set():
+                    return None
+
+    def stage(target, outputs, *args):
+        try:
+            target(*args)
+        except Exception as e:
+            error.append(e)
+            stop.set()
+        finally:
+            for q in outputs:
+                put(q, None)  # end marker
+
+    def decode():
+        while True:
+            with instrumentation.timer('preprocess', op='video_decode'):
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                frame = cv2.resize(frame, EXPORT_SIZE)
+            instrumentation.count('frames_decoded')
+            for q in model_inputs:
+                put(q, frame)
+            if stop.is_set():
+                break
+
+    def infer(model, model_name, inputs, outputs):
+        while (frame := get(inputs)) is not None:
+            with instrumentation.timer('inference', model=model_name):
+                results = model(frame, verbose=False)
+            with instrumentation.timer('render'):
+                panel = results[0].plot()
+                cv2.putText(panel, model_name, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+            put(outputs, panel)
+
+    os.makedirs(os.path.dirname(os.path.abspath(export_path)), exist_ok=True)
+    if layout == 'per-model':
+        stem, ext = os.path.splitext(export_path)
+        paths = [f"{stem}_{os.path.splitext(name)[0]}{ext}" for name in model_names]
+        writers = [cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, EXPORT_SIZE) for path in paths]
+    else:
+        paths = [export_path]
+        writers = [cv2.VideoWriter(export_path, cv2.VideoWriter_fourcc(*'mp4v'), fps,
+                                   (EXPORT_SIZE[0] * len(models), EXPORT_SIZE[1]))]
+    # An unusable path or codec only shows here, write() would silently drop every frame
+    failed = [path for path, writer in zip(paths, writers) if not writer.isOpened()]
+    if failed:
+        print(f"Could not open {', '.join(failed)} for writing (mp4v codec)")
+        for writer in writers:
+            writer.release()
+        cap.release()
+        return False
+
+    threads = [threading.Thread(target=stage, args=(decode, model_inputs), daemon=True)]
+    threads += [threading.Thread(target=stage, args=(infer, [out], model, name, inp, out), daemon=True)
+                for model, name, inp, out in zip(models, model_names, model_inputs, model_outputs)]
+    for thread in threads:
+        thread.start()
+
+    # Encoding runs here; every model sees the frames in order, so one panel from each queue is one output frame
+    written = 0
+    start = time.perf_counter()
+    while True:
+        panels = [get(q) for q in model_outputs]
+        if any(panel is None for panel in panels):
             break
-        elif key == 2:  # Left arrow key
-            frame_idx = max(0, frame_idx - 1)
-        elif key == ord('s'):
-            save_images(models, model_names, frame, video_path)
-            frame_idx += 1
-        else:
-            frame_idx += 1
+        with instrumentation.timer('disk_io', op='video_encode'):
+            if layout == 'per-model':
+                for writer, panel in zip(writers, panels):
+                    writer.write(panel)
+            else:
+                writers[0].write(np.hstack(panels))
+        written += 1
+        if written % 100 == 0:
+            elapsed = time.perf_counter() - start
+            print(f"{written}/{total or '?'} frames, {written / elapsed:.1f} frames/s")
+    elapsed = time.perf_counter() - start
 
+    stop.set()
+    for thread in threads:
+        thread.join()
+    for writer in writers:
+        writer.release()
     cap.release()
-    cv2.destroyAllWindows()
+
+    if error:
+        print(f"Export failed after {written} frames: {error[0]}")
+        return False
+    print(f"Exported {written} frames of {len(models)} models in {elapsed:.1f} s "
+          f"({written / max(elapsed, 1e-9):.1f} frames/s end to end) to {', '.join(paths)}")
+    return True
+
+
+def has_image_header(path):
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(12)
+    except OSError:
+        return False
+    return head.startswith(IMAGE_SIGNATURES) or (head[:4] == b'RIFF' and head[8:12] == b'WEBP')
+
+
+def load_image(img_path):
+    """The image resized to 800x600, or None if it is not an image after all."""
+    if not has_image_header(img_path):
+        return None
+    with instrumentation.timer('preprocess'):
+        img = cv2.imread(img_path)
+        if img is None:
+            return None
+        return cv2.resize(img, (800, 600))  # Resize image to 800x600
 
 
 def process_images(image_folder, models, model_names):
-    image_files = [os.path.join(image_folder, img)
-                   for img in os.listdir(image_folder)]
-    image_files = [img for img in image_files if cv2.imread(img) is not None]
+    # Filtered by extension only, the header is checked when an image is reached, so nothing is decoded up front
+    with instrumentation.timer('disk_io', op='folder_scan'):
+        image_files = [entry.path for entry in os.scandir(image_folder)
+                       if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS)]
+    # The next image is decoded in the background while the current one is on screen
+    loader = ThreadPoolExecutor(max_workers=1)
+    pending = {}  # img_path -> Future of the loaded image
+    results_cache = OrderedDict()  # img_path -> [results per model]
     idx = 0
 
     while idx < len(image_files):
         img_path = image_files[idx]
-        img = cv2.imread(img_path)
-        img = cv2.resize(img, (800, 600))  # Resize image to 800x600
+        future = pending.pop(img_path, None) or loader.submit(load_image, img_path)
+        if idx + 1 < len(image_files):
+            next_path = image_files[idx + 1]
+            pending = {next_path: pending.get(next_path) or loader.submit(load_image, next_path)}
+        img = future.result()
+        if img is None:
+            print(f"Skipping {img_path}: not a readable image")
+            del image_files[idx]
+            continue
+
+        all_results = results_cache.get(img_path)
+        if all_results is None:
+            all_results = []
+            for model, model_name in zip(models, model_names):
+                with instrumentation.timer('inference', model=model_name):
+                    all_results.append(model(img))
+            results_cache[img_path] = all_results
+            while len(results_cache) > RESULTS_CACHE_IMAGES:
+                results_cache.popitem(last=False)
+        else:
+            results_cache.move_to_end(img_path)
 
-        for model, model_name in zip(models, model_names):
-            results = model(img)
+        for results, model_name in zip(all_results, model_names):
             visualize_and_display(
                 img, results, f'YOLOv11 Detection - {model_name}', save=True, savename=f'visualize_output/{model_name}_{os.path.basename(img_path)}')
 
@@ -106,11 +301,12 @@ def process_images(image_folder, models, model_names):
         elif key == 2:  # Left arrow key
             idx = max(0, idx - 1)
         elif key == ord('s'):
-            save_images(models, model_names, img, img_path)
+            save_images(models, model_names, img, img_path, all_results)
             idx += 1
         else:
             idx += 1
 
+    loader.shutdown(wait=False, cancel_futures=True)
     cv2.destroyAllWindows()
 
 
@@ -121,14 +317,35 @@ def main():
                         help='Path to folder containing images')
     parser.add_argument('--models', type=str, nargs='+',
                         help='Paths to YOLO models', required=True)
+    parser.add_argument('--precision', type=str, choices=PRECISION_MODES, default='fp32',
+                        help='CPU inference precision: fp32, bf16 (autocast) or int8 (OpenVINO INT8 export, needs the openvino extra: uv sync --extra openvino)')
+    parser.add_argument('--int8-data', type=str, default=None,
+                        help='Dataset yaml to calibrate the INT8 export with (only needed the first time)')
+    parser.add_argument('--export', type=str, default=None,
+                        help='Write the annotated video to this file instead of showing it (e.g. comparison.mp4)')
+    parser.add_argument('--layout', type=str, choices=['side-by-side', 'per-model'], default='side-by-side',
+                        help='--export: one video with all models next to each other, or one video per model')
+    parser.add_argument('--queue-size', type=int, default=8,
+                        help='--export: frames buffered between the decode, inference and encode threads')
+    parser.add_argument('--buffer-frames', type=int, default=64,
+                        help='Decoded video frames kept for stepping back (about 1.4 MB each)')
+    parser.add_argument('--prefetch', type=int, default=4,
+                        help='Video frames decoded and inferred ahead in the background (0 to disable)')
+    parser.add_argument('--metrics-out', type=str, default=os.environ.get(instrumentation.METRICS_OUT_ENV),
+                        help='Write timings and counters to this file at exit (*.prom for Prometheus, else JSON lines)')
     args = parser.parse_args()
+    instrumentation.configure(args.metrics_out)
 
     print("Using models:", args.models)
-    models = [YOLO(model_path) for model_path in args.models]
+    with instrumentation.timer('model_load'):
+        models = [load_cpu_precision_model(model_path, args.precision, args.int8_data) for model_path in args.models]
     model_names = [os.path.basename(model_path) for model_path in args.models]
 
-    if args.video:
-        process_video(args.video, models, model_names)
+    if args.video and args.export:
+        if not export_video(args.video, models, model_names, args.export, args.layout, args.queue_size):
+            sys.exit(1)
+    elif args.video:
+        process_video(args.video, models, model_names, args.buffer_frames, args.prefetch)
     elif args.images:
         process_images(args.images, models, model_names)
     else: